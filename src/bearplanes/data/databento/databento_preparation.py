@@ -1,51 +1,252 @@
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
+import numpy as np
 import pandas as pd
+import pyarrow.dataset as ds
 
+# ts_event is carried as int64 nanoseconds since epoch
+ONE_DAY_NS = 86_400_000_000_000
+
+# the only columns aggregate_publisher_data touches, reading just these keeps instrument_id etc.
+# out of memory and out of the groupby working set
+AGGREGATION_COLUMNS = ['ts_event', 'symbol', 'rtype', 'publisher_id', 'open', 'high', 'low', 'close', 'volume']
+# the columns symbols_with_multiple_instrument_ids needs
+SYMBOLOGY_COLUMNS = ['symbol', 'instrument_id']
+# column order of the aggregated output
+OUTPUT_COLUMNS = ['ts_event', 'rtype', 'publisher_id', 'symbol', 'high', 'low', 'open', 'close', 'volume']
+
+def load_publisher_data(
+    path,
+    columns: Optional[List[str]] = AGGREGATION_COLUMNS
+    ) -> pd.DataFrame:
+    """
+    Load the publisher level OHLCV data written by unpack.convert_to_parquet
+
+    Reading parquet with pyarrow skips the csv text parsing entirely and hands back typed columns.
+    Only AGGREGATION_COLUMNS are read by default, pass SYMBOLOGY_COLUMNS for the instrument_id
+    check or columns=None to read everything.
+    """
+    return pd.read_parquet(path, engine='pyarrow', columns=columns)
 
 def aggregate_publisher_data(df: pd.DataFrame):
     """
     create a single record of truth for each stock
-    
+
+    One stable sort by (ts_event, symbol, volume descending) makes every group contiguous with its
+    primary exchange row first, _group_starts finds where the groups begin and ufunc.reduceat reduces
+    high, low and volume over each run. No groupby, symbol as a category (see
+    unpack.process_databento_zstfiles) is compared by its int codes
+    """
+    keys = ['ts_event', 'symbol']
+
+    # sort once so each (ts_event, symbol) group is contiguous with its highest volume row first,
+    # "value from the max volume row" is then just the first row of the group (stable sort keeps idxmax's tie order)
+    df = df.sort_values(keys + ['volume'], ascending=[True, True, False], kind='stable')
+
+    if df.empty:
+        return df.reindex(columns=OUTPUT_COLUMNS)
+
+    # with the groups contiguous the aggregation is one sweep over the sorted columns, no groupby hash table:
+    # find where each group starts, take the first row there and reduce each run with ufunc.reduceat
+    starts = _group_starts(df['ts_event'], df['symbol'])
+
+    high = df['high'].to_numpy()
+    low = df['low'].to_numpy()
+    volume = df['volume'].to_numpy()
+    if volume.dtype.kind == 'f':
+        volume = np.nan_to_num(volume)
+
+    # primary exchange (max volume) columns
+    result = df[['ts_event', 'rtype', 'publisher_id', 'symbol', 'open', 'close']].iloc[starts]
+    result = result.reset_index(drop=True)
+
+    # fmax/fmin skip NaN like groupby max/min, volume sums into 64 bits like groupby sum
+    result['high'] = np.fmax.reduceat(high, starts)
+    result['low'] = np.fmin.reduceat(low, starts)
+    result['volume'] = np.add.reduceat(volume, starts, dtype=_sum_dtype(volume.dtype))
+
+    return result.reindex(columns=OUTPUT_COLUMNS, copy=False)
+
+def _group_starts(
+    ts_event: pd.Series,
+    symbol: pd.Series
+    ) -> np.ndarray:
+    """
+    Positions where a new (ts_event, symbol) group begins in a frame sorted by those keys
+    """
+    ts = ts_event.to_numpy()
+    # compare the int codes rather than the strings when symbol is a category
+    sym = symbol.cat.codes.to_numpy() if isinstance(symbol.dtype, pd.CategoricalDtype) else symbol.to_numpy()
+
+    boundary = np.empty(len(ts), dtype=bool)
+    boundary[0] = True
+    np.not_equal(ts[1:], ts[:-1], out=boundary[1:])
+    boundary[1:] |= sym[1:] != sym[:-1]
+
+    return np.flatnonzero(boundary)
+
+def _sum_dtype(dtype: np.dtype) -> np.dtype:
+    """
+    Accumulator dtype matching pandas' groupby sum
+    """
+    if dtype.kind == 'u':
+        return np.dtype(np.uint64)
+    if dtype.kind in 'ib':
+        return np.dtype(np.int64)
+    return dtype
+
+def aggregate_publisher_data_threaded(
+    df: pd.DataFrame,
+    n_workers: int = 8
+    ) -> pd.DataFrame:
+    """
+    Run aggregate_publisher_data over symbol shards in a thread pool
+
+    A (ts_event, symbol) group never spans symbols, so each shard aggregates independently. The heavy parts of
+    aggregate_publisher_data, the numeric sort and the take/reduceat sweeps over the sorted columns, run in
+    numpy's C loops which release the GIL, only the frame building around them holds it. Whether that beats the
+    single sorted pass depends on the core count, time both on your data. symbol must be a category,
+    the shards are cut on its codes which every shard shares.
+    """
+    shard_ids = df['symbol'].cat.codes.to_numpy() % n_workers
+    shards = [df[shard_ids == shard] for shard in range(n_workers)]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(aggregate_publisher_data, shards))
+
+    # the aggregated frame is small next to the input, sort it back into the single threaded order
+    return pd.concat(results, ignore_index=True).sort_values(['ts_event', 'symbol'], ignore_index=True)
+
+def aggregate_publisher_parquet(
+    path,
+    batch_size: int = 1_000_000
+    ) -> pd.DataFrame:
     """
-    # get the row indicies with max volume for each group
-    idx_max_volume = df.groupby(['ts_event', 'symbol'])['volume'].idxmax()
+    Stream the parquet written by unpack.convert_to_parquet through aggregate_publisher_data a record batch at a time
 
-    # get the full rows with max volume 
-    primary_exchange = df.loc[idx_max_volume][['ts_event', 'symbol', 'rtype', 'publisher_id', 'open', 'close']]
+    Memory is capped at roughly one batch instead of the whole file. The file is written sorted by ts_event,
+    so a (ts_event, symbol) group can only be split across the boundary between two batches. The rows holding
+    the last ts_event of each batch are carried into the next one, which keeps the result exact.
+    """
+    dataset = ds.dataset(path, format='parquet')
+
+    partials = []
+    carry = None
+
+    for batch in dataset.to_batches(columns=AGGREGATION_COLUMNS, batch_size=batch_size):
+        if batch.num_rows == 0:
+            continue
+
+        df = batch.to_pandas()
+        if carry is not None:
+            df = pd.concat([carry, df], ignore_index=True)
 
-    # do regular aggregation for high, low and volume
-    aggregated = df.groupby(['ts_event', 'symbol']).agg({
-        'high': 'max',
-        'low': 'min',       
-        'volume': 'sum' 
-    }).reset_index()
+        # hold back the last timestamp, its groups may continue in the next batch
+        ts_event = df['ts_event'].to_numpy()
+        tail = ts_event == ts_event[-1]
+        carry = df[tail]
 
-    # merge the primary exchange info with the aggregated data
-    result = aggregated.merge(
-        primary_exchange,
-        on=['ts_event', 'symbol'],
-        how='left'
-    )
+        if not tail.all():
+            partials.append(aggregate_publisher_data(df[~tail]))
 
-    # Reorder columns
-    result = result[['ts_event', 'rtype', 'publisher_id', 'symbol', 'high', 'low', 'open', 'close', 'volume']]
+    if carry is not None:
+        partials.append(aggregate_publisher_data(carry))
+
+    if not partials:
+        raise ValueError(f"no rows found in {path}")
+
+    # each batch decodes symbol with its own dictionary, re-categorize once over the combined result
+    result = pd.concat(partials, ignore_index=True)
+    result['symbol'] = result['symbol'].astype('category')
 
     return result
 
+def symbols_with_multiple_instrument_ids(df: pd.DataFrame) -> pd.Series:
+    """
+    Find symbols that map to more than one databento instrument_id
+
+    Dropping duplicate (symbol, instrument_id) pairs is one global hash pass, counting the symbols
+    left over avoids building a python set per group like groupby().nunique() does.
+
+    Returns:
+        Series indexed by symbol with the number of instrument_ids, only symbols with more than one
+    """
+    pairs = df[['symbol', 'instrument_id']].drop_duplicates()
+    counts = pairs['symbol'].value_counts()
+
+    return counts[counts > 1]
+
+def cached_symbols_with_multiple_instrument_ids(
+    path,
+    cache_path=None
+    ) -> pd.Series:
+    """
+    symbols_with_multiple_instrument_ids for the parquet at path, cached next to it
+
+    The counts are a small (symbol, n_ids) table, so they are written to cache_path
+    (default <path>.symbol_id_counts.parquet) and read back on later runs instead of
+    scanning the full file again. The cache is rebuilt when the source file is newer.
+    """
+    if cache_path is None:
+        cache_path = f"{os.path.splitext(path)[0]}.symbol_id_counts.parquet"
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return pd.read_parquet(cache_path, engine='pyarrow')['n_ids']
+
+    counts = symbols_with_multiple_instrument_ids(load_publisher_data(path, columns=SYMBOLOGY_COLUMNS))
+    counts = counts.rename_axis('symbol').rename('n_ids')
+    counts.to_frame().to_parquet(cache_path, engine='pyarrow')
+
+    return counts
+
+def _next_event_ns(
+    instrument_ids: np.ndarray,
+    ts_event: np.ndarray
+    ) -> np.ndarray:
+    """
+    Single linear pass over arrays sorted by (instrument_id, ts_event).
+
+    Each row gets the next row's ts_event when the next row is the same instrument, the last row
+    of every instrument gets ts_event + ONE_DAY_NS. Works on the raw numpy arrays so there is no
+    groupby indexer to build.
+    """
+    knowledge = ts_event + ONE_DAY_NS
+    same_instrument = instrument_ids[:-1] == instrument_ids[1:]
+    knowledge[:-1][same_instrument] = ts_event[1:][same_instrument]
+    return knowledge
+
+def _is_sorted_by_instrument(
+    instrument_ids: np.ndarray,
+    ts_event: np.ndarray
+    ) -> bool:
+    """
+    True when the arrays are already ordered by (instrument_id, ts_event), one vectorized neighbour comparison
+    """
+    id_up = instrument_ids[:-1] < instrument_ids[1:]
+    id_same = instrument_ids[:-1] == instrument_ids[1:]
+    return bool(np.all(id_up | (id_same & (ts_event[:-1] <= ts_event[1:]))))
+
 # create knowledge_date, this code needs to be looked at
 def knowledge_date(df: pd.DataFrame):
     """
     Create a date representing when information was actually available for trading decisions
+
+    ts_event is expected as int64 nanoseconds (see unpack.process_databento_zstfiles), so
+    knowledge_date is plain integer arithmetic in the same units
     """
-    df = df.sort_values(['instrument_id', 'ts_event'])
-    
-    # Shift the date forward by one trading day
-    # Use the next row's date as the "knowledge date" for current row's data
-    df['knowledge_date'] = df.groupby('instrument_id')['ts_event'].shift(-1)
-    
-    # For the last row of each stock, manually set knowledge_date
+    # the sort is the expensive part, skip it when the frame already comes in (instrument_id, ts_event) order
+    if not _is_sorted_by_instrument(df['instrument_id'].to_numpy(), df['ts_event'].to_numpy()):
+        df = df.sort_values(['instrument_id', 'ts_event'])
+    else:
+        df = df.copy()
+
+    # Use the next row's date as the "knowledge date" for current row's data, once sorted the rows of
+    # each stock are contiguous so this is the ts_event column shifted up by one row.
+    # For the last row of each stock knowledge_date is set one day later
     # (though you'll likely drop these rows anyway due to missing future data)
-    df['knowledge_date'] = df['knowledge_date'].fillna(df['ts_event'] + pd.Timedelta(days=1))
-    
-    return df 
\ No newline at end of file
+    df['knowledge_date'] = _next_event_ns(df['instrument_id'].to_numpy(), df['ts_event'].to_numpy())
+
+    return df
@@ -1,4 +1,5 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import databento as db
 from databento.common.enums import JobState
@@ -9,8 +10,9 @@ load_dotenv()
 data_client = db.Historical(os.getenv('DATABENTO_API_KEY'))
 reference_client = db.Reference(os.getenv('DATABENTO_API_KEY'))
 
-# test symbols
-test_symbols = ["TMQ", "SOPA", "ONMD", "BJDX", 
+# test symbols, dict.fromkeys drops any repeats (keeping order) so a symbol is never requested twice,
+# and the tuple keeps the list from being mutated by the functions below
+test_symbols = tuple(dict.fromkeys(["TMQ", "SOPA", "ONMD", "BJDX", 
                 "SCWO", "CRML", "ARBK", "CLBT",
                 "KRYS", "RYN", "PKST", "GXO", 
                 "ASMIY", "ASTH", "OS", "INTA", 
@@ -18,14 +20,14 @@ test_symbols = ["TMQ", "SOPA", "ONMD", "BJDX",
                 "STI", "AQMS", "GWH", "NVA",
                 "ELBM", "WWR", "GWAV", "COOT", 
                 "GME", "OMER", "PFAI", "LAES", 
-                "NUAI", "NVTS"]
+                "NUAI", "NVTS"]))
 
 # function to run a batch download
 def test_batch_download():
     # send job
     job = data_client.batch.submit_job(
         dataset = "DBEQ.BASIC", # guess this only goes back until 2023
-        symbols = test_symbols,
+        symbols = list(test_symbols),
         stype_in = "raw_symbol",
         encoding = "dbn",
         schema = "ohlcv-1d",
@@ -35,13 +37,30 @@ def test_batch_download():
 
     return job.id
 
-def download_from_databento():
+def download_from_databento(
+    job_id: str,
+    output_dir: str = r"",
+    max_workers: int = 8
+    ):
     # download OHLCV data files
     print("\nDownloading files...")
-    data_client.batch.download(
-        # job_id= (just update manually for now)
-        output_dir=r""
-    )
+
+    # batch.download pulls a job's files one after another, list the files and fetch each one
+    # from its own thread instead (the http calls release the GIL while they wait)
+    files = data_client.batch.list_files(job_id)
+
+    def download_file(file):
+        return data_client.batch.download(
+            output_dir=output_dir,
+            job_id=job_id,
+            filename_to_download=file['filename']
+        )
+
+    # max_workers also caps how many requests are in flight against the API at once
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        downloaded = list(executor.map(download_file, files))
+
+    print(f"Downloaded {len(downloaded)} files")
     
     # save job metadata to JSON file
     # metadata_path = r""
@@ -1,10 +1,13 @@
 import os
 
+import numpy as np
 import pandas as pd
 from databento import DBNStore
 
 folder_path = r""
 
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+
 # gets all files including json files
 def get_files():
 
@@ -27,18 +30,50 @@ def process_databento_zstfiles():
 
         # Skip non-DBN files (like metadata.json)
         if file.endswith('.zst'):
-            file_data = DBNStore.from_file(file).to_df()
+            # decode the DBN records straight into a frame, pretty_ts=False leaves the timestamps as
+            # the raw nanosecond integers instead of building datetimes we would convert right back
+            file_data = DBNStore.from_file(file).to_df(pretty_ts=False)
             file_data = file_data.reset_index()
             dataframes.append(file_data)
         else:
             continue
 
-    # concatenate all dataframes at once 
+    # concatenate all dataframes at once
     if dataframes:
-        return pd.concat(dataframes, ignore_index=True)
-    else: 
+        data = pd.concat(dataframes, ignore_index=True)
+    else:
         raise ValueError("something went wrong - no .zst files found")
 
-def convert_to_csv():
-    test_data = process_databento_zstfiles()
+    # symbol is the groupby key downstream, as a category the groups hash int codes instead of python strings
+    # (done after the concat, concatenating categoricals with different categories falls back to object)
+    data['symbol'] = data['symbol'].astype('category')
+
+    # ts_event comes out of DBN as uint64 nanoseconds, keep it as int64 so groupby/sort never touch datetime objects
+    data['ts_event'] = data['ts_event'].astype('int64')
+
+    # downcast the OHLCV columns, daily equity prices fit comfortably in float32 and the narrower
+    # columns halve the bytes the (memory bound) aggregation has to move
+    data[PRICE_COLUMNS] = data[PRICE_COLUMNS].astype('float32')
+
+    # only narrow volume and publisher_id when every value fits, aggregate_publisher_data sums volume into uint64
+    if data['volume'].max() <= np.iinfo(np.uint32).max:
+        data['volume'] = data['volume'].astype('uint32')
+    if data['publisher_id'].max() <= np.iinfo(np.uint8).max:
+        data['publisher_id'] = data['publisher_id'].astype('uint8')
+    data['rtype'] = data['rtype'].astype('uint8')
+
+    return data
+
+def convert_to_parquet(output_path):
+    """
+    Write the unpacked DBN data to a single parquet file instead of a csv intermediate
+
+    Parquet keeps the int64 ts_event and categorical symbol as typed columns, read it back with
+    databento_preparation.load_publisher_data
+    """
+    data = process_databento_zstfiles()
+
+    # written in ts_event order so databento_preparation.aggregate_publisher_parquet can stream it in batches
+    data = data.sort_values('ts_event', kind='stable')
+    data.to_parquet(output_path, engine='pyarrow', compression='zstd', index=False)
 
@@ -2,11 +2,19 @@
 
 from bearplanes.data.polygon.cleaning import run_cleaning
 from bearplanes.data.polygon.client import PolygonS3Client
-from bearplanes.data.polygon.utils import add_datetime
+from bearplanes.data.polygon.utils import (AsyncRateLimiter, FileCache,
+                                           add_datetime, get_ticker_list,
+                                           read_partitioned_parquet,
+                                           write_partitioned_parquet)
 
 __all__ = [
     "PolygonS3Client",
     "run_cleaning",
     "add_datetime",
+    "get_ticker_list",
+    "read_partitioned_parquet",
+    "write_partitioned_parquet",
+    "AsyncRateLimiter",
+    "FileCache",
 ]
 
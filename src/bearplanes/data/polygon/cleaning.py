@@ -1,8 +1,12 @@
 import re
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 
+# The three filters of extract_tickers as one alternation: test tickers (case-insensitive), the ZVZZT/ZWZZT
+# test tickers, and non-equities marked by a lowercase letter or period (.WS, pC, w, rw, ...)
+NON_EQUITY_PATTERN = re.compile(r'(?i:test)|^(?:ZVZZT|ZWZZT)$|[a-z.]')
 
 def sanitize_non_string_tickers(
     df: pd.DataFrame
@@ -20,29 +24,30 @@ def sanitize_non_equities(
     ) -> pd.DataFrame:
     """
     This function removes rights, warrants,  pre-merger spacs, pref shares, etc
-    """
-
-    unique_tickers = df['ticker'].unique()
-
-    # Collect a list of all the tickers series we should remove based on the 
-    # regex patterns in the extract_tickers helper function
-    tickers_to_remove = []
 
-    for ticker in unique_tickers:
-        if remove_ticker := extract_tickers(ticker):
-            tickers_to_remove.append(remove_ticker)
+    The regex runs once per unique ticker (the categories when ticker is a category) in a single vectorized
+    str.contains, the per ticker result is then spread to the rows through the int codes
+    """
+    codes, unique_tickers = _ticker_codes(df['ticker'])
 
-    # Create a single boolean mask of all tickers we want to remove 
-    mask_to_remove = df['ticker'].isin(tickers_to_remove)
+    # True for each unique ticker matching NON_EQUITY_PATTERN, padded with False so a missing ticker (code -1) is kept
+    remove_ticker = np.append(_non_equity_tickers(unique_tickers), False)
 
-    # Negate the mask using the tilde operator, this selects all rows where the ticker is NOT in the list to remove
-    mask_to_keep = ~mask_to_remove
+    # Negate the mask using the tilde operator, this selects all rows where the ticker is NOT one to remove
+    mask_to_keep = ~remove_ticker[codes]
 
-    # Apply the mask
-    OHLCV_filtered = df[mask_to_keep]
+    # Apply the mask, turned into row positions once so every column is a plain take instead of
+    # each column unpacking the boolean mask on its own
+    OHLCV_filtered = df.take(np.flatnonzero(mask_to_keep))
 
     return OHLCV_filtered
 
+def _non_equity_tickers(unique_tickers: pd.Index) -> np.ndarray:
+    """
+    One flag per unique ticker, True where it matches NON_EQUITY_PATTERN
+    """
+    return np.asarray(unique_tickers.str.contains(NON_EQUITY_PATTERN, na=False), dtype=bool)
+
 def extract_tickers(
     ticker: str) -> Optional[str]:
     """
@@ -66,21 +71,13 @@ def extract_tickers(
 
         If the ticker passed in does not match any of the cases below, we return None, keeping that ticker and its series in the data.
     """
-    # Match test tickers (case-insensitive)
-    if re.search(r'(?i)test', ticker):
-        # Handle test tickers
-        return ticker
-
-    # Match ZVZZT/ZWZZT test tickers
-    elif re.match(r'^(ZVZZT|ZWZZT)$', ticker):
-        return ticker
-
-    # Match non-equities (lowercase/period suffixes)
-    elif re.match(r'^([^a-z.]*)([a-z.].*)$', ticker):
+    # Match test tickers, ZVZZT/ZWZZT test tickers and non-equities (lowercase/period suffixes),
+    # the same NON_EQUITY_PATTERN sanitize_non_equities applies to the whole column
+    if NON_EQUITY_PATTERN.search(ticker):
         return ticker
 
     # If no pattern matches None is passed to the calling source by default which is an instance of class 'NoneType'
-    pass
+    return None
 
 def sanitize_duplicates(
     df: pd.DataFrame
@@ -94,13 +91,11 @@ def sanitize_duplicates(
             
     """ 
 
-    # Find the duplcate rows
-    duplicate_rows = df[df.duplicated(subset=['ticker', 'date'], keep=False)]
-
-    # Create a boolean mask using the duplicate rows
-    mask = ~df.set_index(['ticker', 'date']).index.isin(duplicate_rows.set_index(['ticker', 'date']).index)
+    # keep=False flags every copy of a duplicated (ticker, date), negated it is already the mask of rows to keep,
+    # no intermediate frame of the duplicates or MultiIndex isin
+    mask = ~df.duplicated(subset=['ticker', 'date'], keep=False).to_numpy()
 
-    OHLCV_filtered = df[mask].reset_index(drop=True)    
+    OHLCV_filtered = df.take(np.flatnonzero(mask)).reset_index(drop=True)
 
     return OHLCV_filtered
 
@@ -115,28 +110,72 @@ def sanitize_low_volume(
     """
 
     # Find and analyze the number of tickers that have MAX 100 shares volume across their entire series 
-    # Compute max volume and max price per ticker in one pass
-    ticker_stats = df.groupby('ticker').agg({
-        'volume': 'max',
-        'close': 'max'
-    }).reset_index()
+    # Compute max volume and max price per ticker straight from the int ticker codes, one unbuffered
+    # fmax.at reduction per column instead of a groupby building its hash table and result frame
+    codes, unique_tickers = _ticker_codes(df['ticker'])
+    has_ticker = codes >= 0
+
+    # Flag the tickers that are below the criteria, padded with False so rows without a ticker (code -1) are kept
+    invalid_ticker = np.append(
+        _low_volume_tickers(
+            codes[has_ticker],
+            df['volume'].to_numpy()[has_ticker],
+            df['close'].to_numpy()[has_ticker],
+            len(unique_tickers)
+        ),
+        False
+    )
+
+    # Negate the mask using the tilde operator, this selects all rows where the ticker is NOT one to remove
+    mask_to_keep = ~invalid_ticker[codes]
 
-    # Filter tickers into a list that are below the criteria
-    invalid_tickers = ticker_stats[
-        (ticker_stats['volume'] < 1000) |
-        (ticker_stats['close'] < 0.01)
-    ]['ticker'].tolist()
+    # Apply the mask
+    OHLCV_filtered = df.take(np.flatnonzero(mask_to_keep))
 
-    # Create a single boolean mask of all tickers we want to remove 
-    mask_to_remove = df['ticker'].isin(invalid_tickers)
+    return OHLCV_filtered
 
-    # Negate the mask using the tilde operator, this selects all rows where the ticker is NOT in the list to remove
-    mask_to_keep = ~mask_to_remove
+def _low_volume_tickers(
+    codes: np.ndarray,
+    volume: np.ndarray,
+    close: np.ndarray,
+    n_tickers: int
+    ) -> np.ndarray:
+    """
+    One flag per ticker code, True where the ticker never traded 1,000 shares or never closed at $0.01 or more
+    (a NaN max, a ticker without any value, is kept like the groupby version did)
+    """
+    max_volume = _group_max(codes, volume, n_tickers)
+    max_close = _group_max(codes, close, n_tickers)
 
-    # Apply the mask
-    OHLCV_filtered = df[mask_to_keep]
+    return (max_volume < 1000) | (max_close < 0.01)
 
-    return OHLCV_filtered
+def _ticker_codes(tickers: pd.Series) -> tuple:
+    """
+    Int codes of the tickers (-1 for a missing ticker) and the Index of tickers they point into,
+    read off the category when ticker is one (normalize_datatypes makes it one), otherwise factorized
+    """
+    if isinstance(tickers.dtype, pd.CategoricalDtype):
+        return tickers.cat.codes.to_numpy(), tickers.cat.categories
+
+    codes, uniques = pd.factorize(tickers)
+    return codes, pd.Index(uniques)
+
+def _group_max(
+    codes: np.ndarray,
+    values: np.ndarray,
+    n_groups: int
+    ) -> np.ndarray:
+    """
+    Max of values per code, NaN skipping like groupby max (NaN for a group without any value)
+    """
+    if values.dtype.kind in 'iu':
+        result = np.full(n_groups, np.iinfo(values.dtype).min, dtype=values.dtype)
+    else:
+        values = values.astype(np.float64, copy=False)
+        result = np.full(n_groups, np.nan)
+    np.fmax.at(result, codes, values)
+
+    return result
 
 def normalize_datatypes(
     df: pd.DataFrame
@@ -165,19 +204,27 @@ def normalize_datatypes(
         transactions                    int64
 
     """
-    # Create a copy to avoid SettingWithCopyWarning
-    df = df.copy()
-    
-    # Explicitly set the datatypes for each column
-    df.loc[:, 'date'] = pd.to_datetime(df.loc[:, 'window_start'], unit='ns').dt.normalize()
-    df.loc[:, 'window_start'] = df.loc[:, 'window_start'].astype('int64')
-    df.loc[:, 'ticker'] = df.loc[:, 'ticker'].astype('category')
-    df.loc[:, 'open'] = df.loc[:, 'open'].astype('float64')
-    df.loc[:, 'close'] = df.loc[:, 'close'].astype('float64')
-    df.loc[:, 'high'] = df.loc[:, 'high'].astype('float64')
-    df.loc[:, 'low'] = df.loc[:, 'low'].astype('float64')
-    df.loc[:, 'volume'] = df.loc[:, 'volume'].astype('int64')
-    df.loc[:, 'transactions'] = df.loc[:, 'transactions'].astype('int64')
+    # Explicitly set the datatypes for each column in one astype, which also returns the new frame
+    # (no separate copy needed to leave the caller's frame alone). Assigning through df.loc[:, col]
+    # writes into the existing column and keeps its old dtype, so ticker never actually became a category.
+    # ticker is converted here once, every later cleaning step works on its int codes
+    df = df.astype({
+        'window_start': 'int64',
+        'ticker': 'category',
+        'open': 'float64',
+        'close': 'float64',
+        'high': 'float64',
+        'low': 'float64',
+        'volume': 'int64',
+        'transactions': 'int64'
+    })
+    # a category read from a pyarrow dictionary keeps its first-seen category order and astype leaves it,
+    # sort the categories so the codes (which the later steps sort by) are in ticker order
+    df['ticker'] = df['ticker'].cat.reorder_categories(df['ticker'].cat.categories.sort_values())
+
+    # skip the datetime conversion if add_datetime already built the date column, it is the same computation
+    if 'date' not in df.columns or not pd.api.types.is_datetime64_any_dtype(df['date']):
+        df['date'] = pd.to_datetime(df['window_start'], unit='ns').dt.normalize()
 
     # Rename window_start to unix_nsec_timestamp
     df = df.rename(columns={'window_start': 'unix_nsec_timestamp'})
@@ -225,7 +272,7 @@ def sanitize_short_series(
     
     tickers_too_little_data = []
 
-    for ticker, group in df.groupby('ticker', observed=True):
+    for ticker, group in df.groupby('ticker', sort=False, observed=True):
         dates = group['date'].unique()
 
         if len(dates) < removal_threshold:
@@ -238,7 +285,7 @@ def sanitize_short_series(
     mask_to_keep = ~mask_to_remove
     
     # Apply the mask
-    OHLCV_filtered = df[mask_to_keep].reset_index(drop=True)
+    OHLCV_filtered = df.take(np.flatnonzero(mask_to_keep)).reset_index(drop=True)
     
     return OHLCV_filtered
 
@@ -249,18 +296,37 @@ def sanitize_warrants_rights_units_non_obvious(
     Removes warrants, rights, and units by checking for 5-character tickers ending in U, W, or R
     that have a matching 4-character base ticker.
     """
-    unique_tickers = df['ticker'].unique()
-    tickers_to_remove = []
+    codes, unique_tickers = _ticker_codes(df['ticker'])
+
+    # only the tickers that still have rows count as a base (categories outlive the rows filtered before)
+    present = np.bincount(codes[codes >= 0], minlength=len(unique_tickers)) > 0
+
+    # padded with False so a missing ticker (code -1) is kept
+    remove_ticker = np.append(_warrant_tickers(unique_tickers, present), False)
+
+    mask_to_keep = ~remove_ticker[codes]
+
+    return df.take(np.flatnonzero(mask_to_keep))
+
+def _warrant_tickers(
+    unique_tickers: pd.Index,
+    present: np.ndarray
+    ) -> np.ndarray:
+    """
+    One flag per unique ticker, True for a 5-character ticker ending in U, W or R whose 4-character
+    base is one of the present tickers
+    """
+    # a set so each base lookup is a hash instead of a scan over the unique tickers
+    present_tickers = set(unique_tickers[present])
 
-    for ticker in unique_tickers:
+    remove_ticker = np.zeros(len(unique_tickers), dtype=bool)
+    for i, ticker in enumerate(unique_tickers):
         if isinstance(ticker, str) and len(ticker) == 5 and ticker[4] in ['U', 'W', 'R']:
             base_ticker = ticker[:4]
-            if base_ticker in unique_tickers:
-                tickers_to_remove.append(ticker)
+            if base_ticker in present_tickers:
+                remove_ticker[i] = True
 
-    mask_to_keep = ~df['ticker'].isin(tickers_to_remove)
-
-    return df[mask_to_keep]
+    return remove_ticker
 
 def run_cleaning(
     df: pd.DataFrame
@@ -278,28 +344,51 @@ def run_cleaning(
     # 1. Drop rows with NaN ticker values
     sanitized_nan = sanitize_non_string_tickers(df)
 
-    # 2. Update types, rename and reorder columns 
+    # 2. Update types, rename and reorder columns (ticker becomes a category)
     normalized_dtypes = normalize_datatypes(sanitized_nan) 
 
-    # 3. Remove duplicates
-    sanitized_duplicates = sanitize_duplicates(normalized_dtypes)
+    # Steps 3-7 are the sanitize_* functions fused into one boolean mask over the normalized frame. Each step
+    # narrows the mask of rows to keep and the rows are selected once at the end, instead of every step
+    # building its own filtered frame. Steps 4-7 drop whole tickers, they are flagged per ticker code
+    codes = normalized_dtypes['ticker'].cat.codes.to_numpy()
+    unique_tickers = normalized_dtypes['ticker'].cat.categories
+    n_tickers = len(unique_tickers)
+
+    # 3. Remove duplicates (every copy of a duplicated ticker, date)
+    keep = ~normalized_dtypes.duplicated(subset=['ticker', 'date'], keep=False).to_numpy()
 
     # 4. Remove low vol 
-    sanitized_low_vol = sanitize_low_volume(sanitized_duplicates)
+    low_volume = _low_volume_tickers(
+        codes[keep],
+        normalized_dtypes['volume'].to_numpy()[keep],
+        normalized_dtypes['close'].to_numpy()[keep],
+        n_tickers
+    )
+    keep &= ~low_volume[codes]
 
     # 5. Remove tickers with very low total trading days, currently selecting 30 
     # (for context this is also doing very little to the shape of the data)
-    sanitized_short_hist = sanitize_short_series(sanitized_low_vol, 30)
+    # with the duplicates gone every kept row is a distinct (ticker, date), so a ticker's trading days are its row count
+    trading_days = np.bincount(codes[keep], minlength=n_tickers)
+    keep &= (trading_days >= 30)[codes]
 
     # 6. Clean for non equities as much as we can using obvious suffixes
-    sanitized_non_equities = sanitize_non_equities(sanitized_short_hist)
+    keep &= ~_non_equity_tickers(unique_tickers)[codes]
 
     # 7. Finally clean for non equities with U, R, and W suffixes based on a base ticker match
-    sanitizedd_non_equities_non_obvious = sanitize_warrants_rights_units_non_obvious(sanitized_non_equities)
+    present = np.bincount(codes[keep], minlength=n_tickers) > 0
+    keep &= ~_warrant_tickers(unique_tickers, present)[codes]
 
     # Sort the dataframe by ticker and date in ascending order
     # This is required for merge_asof operations and ensures consistent ordering for downstream processing
-    OHLCV_processed = sanitizedd_non_equities_non_obvious.sort_values(['ticker', 'date'], kind='stable').reset_index(drop=True)
+    # The sort is worked out on the kept row positions (the category sorts by its codes, lexsort is stable
+    # like kind='stable'), so selecting and sorting the rows is a single take of every column
+    rows = np.flatnonzero(keep)
+    rows = rows[np.lexsort((normalized_dtypes['date'].to_numpy()[rows], codes[rows]))]
+    OHLCV_processed = normalized_dtypes.take(rows).reset_index(drop=True)
+    # the category still lists every dropped ticker, keep only the ones that survived cleaning so
+    # groupby (observed=False), value_counts and .cat.categories do not see empty tickers
+    OHLCV_processed['ticker'] = OHLCV_processed['ticker'].cat.remove_unused_categories()
 
     print("Dataframe after cleaning:")
     print("================================")
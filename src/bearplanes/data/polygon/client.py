@@ -5,6 +5,7 @@ Polygon's daily aggregate data from their S3 bucket.
 """
 
 import asyncio
+import json
 import os
 import re
 from dataclasses import dataclass
@@ -15,8 +16,11 @@ from typing import List, Optional
 import aioboto3
 import boto3
 import pandas as pd
+import pyarrow as pa
 from botocore.config import Config
+from pyarrow import csv as pacsv
 
+from bearplanes.data.polygon.utils import add_datetime
 from bearplanes.utils.config import get_aws_credentials
 
 
@@ -48,6 +52,23 @@ class PolygonS3Client:
     ENDPOINT_URL = 'https://files.polygon.io'
     SIGNATURE_VERSION = 's3v4'
     DAILY_BARS_PREFIX = 'us_stocks_sip/day_aggs_v1/'
+    # parquet copy of the downloaded csv files, written next to them by _read_files_into_df,
+    # with a manifest of the files (name, size, mtime) it was built from
+    DAILY_BARS_PARQUET = 'daily_bars.parquet'
+    DAILY_BARS_MANIFEST = 'daily_bars.manifest.json'
+    # column types for the daily bars csv files, fixed for every column so each day parses to the same
+    # schema (inference would make an all-integer or all-null price column of one day int64 or null)
+    DAILY_BARS_COLUMN_TYPES = {
+        'ticker': pa.dictionary(pa.int32(), pa.string()),
+        # float parses both integer and decimal volumes, normalize_datatypes casts it to int64
+        'volume': pa.float64(),
+        'open': pa.float64(),
+        'close': pa.float64(),
+        'high': pa.float64(),
+        'low': pa.float64(),
+        'window_start': pa.int64(),
+        'transactions': pa.int64(),
+    }
     
     def __init__(
         self,
@@ -80,10 +101,15 @@ class PolygonS3Client:
         skip_existing: bool = True,
         retries: int = 3,
         backoff_seconds: float = 0.5,
-        return_dataframe: bool = False
+        return_dataframe: bool = False,
+        keep_files: bool = True
     ) -> Optional[pd.DataFrame]:
         """Download daily aggregate bars for date range.
         
+        With keep_files=False the csv files never touch the disk, the days are streamed from S3
+        by stream_daily_bars and written to one parquet file in output_dir
+        (daily_bars_{start_date}_{end_date}.parquet) instead.
+        
         Args:
             start_date: Start date in 'YYYY-MM-DD' format (inclusive).
             end_date: End date in 'YYYY-MM-DD' format (exclusive).
@@ -92,7 +118,10 @@ class PolygonS3Client:
             skip_existing: If True, skip files that already exist locally.
             retries: Number of retry attempts per file.
             backoff_seconds: Initial backoff time for retries (exponential).
-            return_dataframe: If True, load all files into a DataFrame and return it.
+            return_dataframe: If True, load all files into a DataFrame and return it. The files are
+                converted to a parquet file in output_dir once and later runs read that instead.
+            keep_files: If False, stream the days instead of downloading the csv files, skip_existing
+                does not apply.
             
         Returns:
             DataFrame if return_dataframe=True, otherwise None.
@@ -100,6 +129,17 @@ class PolygonS3Client:
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
         
+        if not keep_files:
+            result = self.stream_daily_bars(
+                start_date=start_date,
+                end_date=end_date,
+                max_concurrency=max_concurrency,
+                retries=retries,
+                backoff_seconds=backoff_seconds,
+                parquet_path=output_dir / f"daily_bars_{start_date}_{end_date}.parquet"
+            )
+            return result if return_dataframe else None
+        
         # Build download plan
         jobs = self._build_download_list(
             prefix=self.DAILY_BARS_PREFIX,
@@ -125,6 +165,64 @@ class PolygonS3Client:
         
         return None
     
+    def stream_daily_bars(
+        self,
+        start_date: str,
+        end_date: str,
+        max_concurrency: int = 20,
+        retries: int = 3,
+        backoff_seconds: float = 0.5,
+        parquet_path: Optional[Path] = None
+    ) -> pd.DataFrame:
+        """Load daily aggregate bars for date range straight from S3, without writing the files to disk.
+        
+        Each object body is read into memory and parsed by pyarrow's csv reader through a gzip stream
+        while the other downloads are still in flight. download_daily_bars(keep_files=False) calls this,
+        use download_daily_bars with the default keep_files=True to keep the csv files.
+        
+        Args:
+            start_date: Start date in 'YYYY-MM-DD' format (inclusive).
+            end_date: End date in 'YYYY-MM-DD' format (exclusive).
+            max_concurrency: Maximum concurrent downloads.
+            retries: Number of retry attempts per file.
+            backoff_seconds: Initial backoff time for retries (exponential).
+            parquet_path: If given, the frame is also written to this parquet file.
+            
+        Returns:
+            DataFrame of all days in date order, with the date column from add_datetime.
+        """
+        # the local paths of the jobs are not used when streaming
+        jobs = self._build_download_list(
+            prefix=self.DAILY_BARS_PREFIX,
+            start_date=start_date,
+            end_date=end_date,
+            output_dir=Path()
+        )
+        
+        print(f"\nFound {len(jobs)} files to stream")
+        
+        tables = asyncio.run(self._stream_files_async(
+            jobs=jobs,
+            max_concurrency=max_concurrency,
+            retries=retries,
+            backoff_seconds=backoff_seconds
+        ))
+        
+        # days that failed after all retries are left out, like download_daily_bars
+        tables = [table for table in tables if table is not None]
+        if not tables:
+            raise ValueError(f"no daily bars streamed between {start_date} and {end_date}")
+        
+        n_files = len(tables)
+        result = self._tables_to_df(tables)
+        print(f"Loaded {len(result):,} rows from {n_files} files")
+        
+        result = add_datetime(result, 'window_start')
+        if parquet_path is not None:
+            self._write_daily_bars_parquet(result, parquet_path)
+        
+        return result
+    
     def _build_download_list(
         self,
         prefix: str,
@@ -229,11 +327,7 @@ class PolygonS3Client:
         # Create semaphore for bounded concurrency
         semaphore = asyncio.Semaphore(max_concurrency)
         
-        async with self.session.client(
-            's3',
-            endpoint_url=self.ENDPOINT_URL,
-            config=Config(signature_version=self.SIGNATURE_VERSION),
-        ) as s3_async:
+        async with self._async_s3_client(max_concurrency) as s3_async:
             async with asyncio.TaskGroup() as tg:
                 for job in jobs:
                     tg.create_task(self._guarded_download(
@@ -247,6 +341,24 @@ class PolygonS3Client:
         
         print("\nDownload complete!")
     
+    def _async_s3_client(self, max_concurrency: int):
+        """Async S3 client context manager for max_concurrency concurrent requests.
+        
+        Args:
+            max_concurrency: Maximum concurrent requests, the connection pool is sized to it.
+        """
+        # botocore pools only 10 connections by default, which would cap the requests below max_concurrency.
+        # adaptive retries also back off client side when the endpoint starts throttling
+        return self.session.client(
+            's3',
+            endpoint_url=self.ENDPOINT_URL,
+            config=Config(
+                signature_version=self.SIGNATURE_VERSION,
+                max_pool_connections=max_concurrency,
+                retries={'mode': 'adaptive'}
+            ),
+        )
+    
     async def _guarded_download(
         self,
         s3,
@@ -302,9 +414,155 @@ class PolygonS3Client:
         await s3.download_file(self.BUCKET_NAME, job.object_name, job.path)
         print(f"{job.date_str}")
     
+    async def _stream_files_async(
+        self,
+        jobs: List[DownloadJob],
+        max_concurrency: int,
+        retries: int,
+        backoff_seconds: float
+    ) -> List[Optional[pa.Table]]:
+        """Read and parse the objects of jobs concurrently with bounded concurrency.
+        
+        Args:
+            jobs: List of download jobs.
+            max_concurrency: Maximum concurrent downloads.
+            retries: Number of retry attempts.
+            backoff_seconds: Initial backoff time for retries.
+            
+        Returns:
+            One table per job in job order, None for the ones that failed.
+        """
+        print(f"\nStreaming {len(jobs)} files (max concurrency: {max_concurrency})...")
+        print("=" * 40)
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async with self._async_s3_client(max_concurrency) as s3_async:
+            async with asyncio.TaskGroup() as tg:
+                tasks = [
+                    tg.create_task(self._guarded_stream(
+                        s3=s3_async,
+                        semaphore=semaphore,
+                        job=job,
+                        retries=retries,
+                        backoff_seconds=backoff_seconds,
+                    ))
+                    for job in jobs
+                ]
+        
+        return [task.result() for task in tasks]
+    
+    async def _guarded_stream(
+        self,
+        s3,
+        semaphore: asyncio.Semaphore,
+        job: DownloadJob,
+        retries: int,
+        backoff_seconds: float
+    ) -> Optional[pa.Table]:
+        """Stream one object with bounded concurrency and retries.
+        
+        Args:
+            s3: Async S3 client.
+            semaphore: Semaphore for concurrency control.
+            job: Download job.
+            retries: Number of retry attempts.
+            backoff_seconds: Initial backoff time.
+            
+        Returns:
+            The parsed table, None if every attempt failed.
+        """
+        async with semaphore:
+            attempt = 0
+            while True:
+                try:
+                    return await self._stream_file(s3, job)
+                except Exception as e:
+                    attempt += 1
+                    if attempt > retries:
+                        print(f"Failed: {job.date_str} after {retries} retries: {e}")
+                        return None
+                    # Exponential backoff
+                    await asyncio.sleep(backoff_seconds * (2 ** (attempt - 1)))
+    
+    async def _stream_file(
+        self,
+        s3,
+        job: DownloadJob
+    ) -> pa.Table:
+        """Read a single object from S3 and parse it.
+        
+        Args:
+            s3: Async S3 client.
+            job: Download job.
+            
+        Returns:
+            The day's bars as an arrow table.
+        """
+        response = await s3.get_object(Bucket=self.BUCKET_NAME, Key=job.object_name)
+        async with response['Body'] as stream:
+            body = await stream.read()
+        
+        # gunzip while parsing instead of decompressing into a second buffer first, in a thread so
+        # the event loop keeps the other downloads going
+        table = await asyncio.to_thread(
+            self._read_daily_bars_csv,
+            pa.CompressedInputStream(pa.BufferReader(body), 'gzip')
+        )
+        print(f"{job.date_str}")
+        
+        return table
+    
+    def _read_daily_bars_csv(self, source) -> pa.Table:
+        """Parse one daily bars csv (a path or a stream) into an arrow table.
+        
+        Args:
+            source: Path of a csv/csv.gz file or an arrow input stream.
+            
+        Returns:
+            The parsed table.
+        """
+        # pyarrow's multithreaded csv reader (gzip is picked up from a path's extension), ticker is read
+        # straight into a dictionary column so it comes out of to_pandas as a category.
+        # strings_can_be_null matches pd.read_csv, empty/NA tickers come back as NaN
+        convert_options = pacsv.ConvertOptions(
+            column_types=self.DAILY_BARS_COLUMN_TYPES,
+            strings_can_be_null=True
+        )
+        # larger blocks give the threaded parser bigger chunks to split across cores
+        read_options = pacsv.ReadOptions(block_size=32 << 20, use_threads=True)
+        
+        return pacsv.read_csv(source, read_options=read_options, convert_options=convert_options)
+    
+    def _tables_to_df(self, tables: List[pa.Table]) -> pd.DataFrame:
+        """Concatenate the per file tables into one DataFrame.
+        
+        Args:
+            tables: Tables from _read_daily_bars_csv, the list is emptied.
+            
+        Returns:
+            DataFrame with ticker as a category.
+        """
+        # concat_tables only stitches the chunks together, no copy. The per file dictionaries are unified
+        # into one set of categories by to_pandas, self_destruct frees each arrow column once it is
+        # converted so the arrow and pandas copies are not both held at full size
+        # permissive promotion covers columns outside DAILY_BARS_COLUMN_TYPES (e.g. one added in later files)
+        table = pa.concat_tables(tables, promote_options='permissive')
+        tables.clear()
+        result = table.to_pandas(split_blocks=True, self_destruct=True)
+        del table
+        
+        return result
+    
     def _read_files_into_df(self, directory: Path) -> pd.DataFrame:
         """Read all CSV.GZ files in directory into a single DataFrame.
         
+        The csv files are parsed once and written to DAILY_BARS_PARQUET in the same directory
+        (with the date column from add_datetime already added), later calls read the parquet
+        instead. DAILY_BARS_MANIFEST records the name, size and mtime of every file the parquet
+        was built from, it is rebuilt whenever the current files do not match that list exactly
+        (a day added, removed or rewritten).
+        
         Args:
             directory: Directory containing CSV.GZ files.
             
@@ -313,15 +571,64 @@ class PolygonS3Client:
         """
         print(f"\nLoading files from {directory}...")
         
-        dataframes = []
         files = sorted([f for f in os.listdir(directory) if f.endswith('csv.gz')])
-        
+        parquet_path = os.path.join(directory, self.DAILY_BARS_PARQUET)
+        manifest_path = os.path.join(directory, self.DAILY_BARS_MANIFEST)
+        manifest = []
         for file in files:
-            filepath = os.path.join(directory, file)
-            df = pd.read_csv(filepath, compression='gzip')
-            dataframes.append(df)
+            stat = os.stat(os.path.join(directory, file))
+            manifest.append([file, stat.st_size, stat.st_mtime_ns])
         
-        result = pd.concat(dataframes, ignore_index=True)
+        # typed binary columns, no csv parsing, ticker comes back as a category
+        if os.path.exists(parquet_path) and self._read_manifest(manifest_path) == manifest:
+            result = pd.read_parquet(parquet_path, engine='pyarrow')
+            print(f"Loaded {len(result):,} rows from {parquet_path}")
+            return result
+        
+        tables = [self._read_daily_bars_csv(os.path.join(directory, file)) for file in files]
+        result = self._tables_to_df(tables)
         print(f"Loaded {len(result):,} rows from {len(files)} files")
         
+        # date is parsed here once rather than on every load, normalize_datatypes skips it when present
+        result = add_datetime(result, 'window_start')
+        self._write_daily_bars_parquet(result, parquet_path)
+        # written after the parquet has replaced the old one, if the run stops in between the old manifest
+        # no longer matches the files (that is why it was rebuilt) and the next call rebuilds again
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        
         return result
+    
+    def _write_daily_bars_parquet(self, df: pd.DataFrame, path) -> None:
+        """Write the daily bars frame to a parquet file, ticker dictionary encoded.
+        
+        Args:
+            df: Daily bars with the date column from add_datetime.
+            path: Parquet file to write.
+        """
+        # write to a temp file and rename so an interrupted write never leaves a partial parquet at path,
+        # the manifest next to a cached parquet only ever describes a complete file
+        tmp_path = f"{path}.tmp"
+        df.to_parquet(
+            tmp_path,
+            engine='pyarrow',
+            compression='zstd',
+            use_dictionary=['ticker'],
+            index=False
+        )
+        os.replace(tmp_path, path)
+    
+    def _read_manifest(self, manifest_path: str) -> Optional[list]:
+        """Read the DAILY_BARS_MANIFEST at manifest_path.
+        
+        Args:
+            manifest_path: Path of the manifest.
+            
+        Returns:
+            The [name, size, mtime_ns] entries, None if the manifest is missing or unreadable.
+        """
+        try:
+            with open(manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
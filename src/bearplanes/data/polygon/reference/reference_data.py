@@ -2,28 +2,28 @@ import asyncio
 import json
 import os
 import sys
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import date
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Dict, List, Set
 
 import aiofiles
+import aiohttp
+import numpy as np
 import pandas as pd
-from dotenv import load_dotenv
-from numpy import result_type
-from polygon import RESTClient
-from polygon.exceptions import BadResponse
-from polygon.rest import reference
-from rich import print
-from tqdm import tqdm as sync_tqdm
+import pyarrow as pa
+import pyarrow.parquet as pq
 from tqdm.asyncio import tqdm
 
-# Add parent directory to path to import cleaning module
+# Add parent directory to path to import utils module
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from cleaning import run_cleaning
+from utils import (AsyncRateLimiter, FailureLog, create_session,
+                   get_json_with_retry)
 
-load_dotenv()
-client = RESTClient(os.getenv("POLYGON_API_KEY"))
+TICKERS_URL = "https://api.polygon.io/v3/reference/tickers"
+
+# failed requests are reported in batches instead of a print per failure
+failure_log = FailureLog("reference data")
 
 @dataclass (frozen = True, slots = True)
 class RefData:
@@ -41,160 +41,282 @@ class RefData:
 	last_updated_utc: str
 	date_param: str
 
+# RefData describes the columns, the rows themselves are built straight into arrow columns in get_reference_data
+REF_DATA_FIELDS = [f.name for f in fields(RefData)]
+# the fields read off the api response, date_param is the date we queried
+REF_DATA_API_FIELDS = [name for name in REF_DATA_FIELDS if name != 'date_param']
+REF_DATA_SCHEMA = pa.schema([(f.name, pa.bool_() if f.type is bool else pa.string()) for f in fields(RefData)])
+# value used when the api response is missing a field
+REF_DATA_DEFAULTS = {f.name: False if f.type is bool else '' for f in fields(RefData)}
+# the dates whose request failed
+FAILED_SCHEMA = pa.schema([('date', pa.string())])
+
 def build_payload(
 	df: pd.DataFrame,
 	threshold: int
-	) -> List[Tuple[str, date]]:
+	) -> Dict[date, Set[str]]:
 	""" 
 	Builds the data that we want to send to the reference API
 
+	list_tickers(date=...) returns every ticker active on that date in one paged response, so instead of
+	one call per (ticker, date) we call once per threshold day window and keep the tickers we care about.
+
 		Args:
 			df: pandas dataframe containing the full OHLCV data 
 			threshold: the frequency with which we call the API on the same ticker
+
+		Returns:
+			dict of window start date -> set of tickers that have rows in that window
 	"""
-	
-	# Get each unique ticker with its first and last date
-	ticker_dates = df.groupby('ticker').agg(
-		first_date=('date', 'min'),
-		last_date=('date', 'max')
-	).reset_index()
-
-	# Generate list of (ticker, date) tuples for each ticker from first_date to first_date + threshold
-	list_of_calls = []
-
-	# for task in tqdm.as_completed(tasks, desc="Fetching reference data", total=len(tasks)):
-
-	# Now fill in dates for each ticker group with the threshold we choose
-	for _, row in ticker_dates:
-		ticker = row['ticker']
-		first_date = pd.to_datetime(row['first_date'])
-		last_date = pd.to_datetime(row['last_date'])
-		
-		# Generate dates from first_date to end_date, with threshold as the interval
-		date_range = pd.date_range(
-			start=first_date,
-			end=last_date,
-			freq=f'{threshold}D'
-		)
-		
-		# Add (ticker, date) tuple for each date
-		for date in date_range:
-			list_of_calls.append((ticker, date.date()))
-	
-	return list_of_calls
+	# Work on the datetime64 values as int64 days, no Timestamp objects per row
+	days = pd.to_datetime(df['date']).to_numpy().astype('datetime64[D]').view('i8')
+	first_day = days.min()
+
+	# Windows start every threshold days from the first date in the data, find the window of each row
+	window = (days - first_day) // threshold
+
+	# Unique (window, ticker) pairs in one numpy pass, encoded as a single int64 key.
+	# factorize codes NaN tickers as -1, which would alias to the previous window's last ticker, drop them
+	codes, uniques = pd.factorize(df['ticker'])
+	has_ticker = codes >= 0
+	keys = np.unique(window[has_ticker] * len(uniques) + codes[has_ticker])
+	key_windows, key_codes = np.divmod(keys, len(uniques))
+
+	# keys are sorted so each window's tickers are contiguous, split them at the window boundaries
+	boundaries = np.flatnonzero(np.diff(key_windows)) + 1
+	window_starts = (first_day + key_windows[np.r_[0, boundaries]] * threshold).astype('datetime64[D]')
+
+	return {
+		start.item(): set(uniques[ticker_codes])
+		for start, ticker_codes in zip(window_starts, np.split(key_codes, boundaries))
+	}
+
+def failed_table(failed_dates: List) -> pa.Table:
+	"""
+	The failed dates as a one column arrow table
+	"""
+	return pa.Table.from_pydict({'date': [str(d) for d in failed_dates]}, schema=FAILED_SCHEMA)
+
+async def save_checkpoint(
+	data: List,
+	type_save: str,
+	filepath: Path
+	):
+	"""
+	Save a batch of results to filepath
+
+		Args:
+			data: arrow table of reference data for the success checkpoints, the failed dates for the failed ones
+			type_save: "parquet" (columnar, zstd) or "json"
+			filepath: file to write, the extension is not changed here
+	"""
+	table = data if isinstance(data, pa.Table) else failed_table(data)
+
+	if type_save == "parquet":
+		# the encode + write is blocking, keep it off the event loop
+		await asyncio.to_thread(pq.write_table, table, filepath, compression='zstd')
+
+	elif type_save == "json":
+		async with aiofiles.open(filepath, 'w') as f:
+			await f.write(json.dumps(table.to_pylist()))
+
+	else:
+		raise ValueError(f"unknown checkpoint type: {type_save}")
 
 async def process_tickers(
-	payload_list: [],
+	payload: Dict[date, Set[str]],
 	batch_size: int,
-	checkpoint_dir: Path
+	checkpoint_dir: Path,
+	type_save: str = "parquet",
+	n_parse_workers: int = 4,
+	session: aiohttp.ClientSession = None
 	):
 	"""
-	Process tickers and checkpoint results incrementally.
+	Process the payload from build_payload and checkpoint results incrementally.
+
+	Pass a session from utils.create_session to share it across calls, otherwise one is opened and closed here.
+
+	Runs as a small pipeline so the event loop only ever drives the http requests:
+		fetch tasks -> raw_queue -> n_parse_workers build the arrow tables (in threads) -> result_queue -> writer task
+
+	Results are written every batch_size reference rows (or failed requests), by default as row groups appended to
+	one parquet file (see write_checkpoints), pass type_save="json" for the old numbered json files.
 	"""
-	# Store the results
-	list_ref_data_buffer = []
-	list_failed_refs = []
+	if session is None:
+		async with create_session() as session:
+			return await process_tickers(payload, batch_size, checkpoint_dir, type_save, n_parse_workers, session)
+
+	# Bounded queues, when parsing or writing falls behind the fetches wait instead of piling up responses in memory
+	raw_queue = asyncio.Queue(maxsize=256)
+	result_queue = asyncio.Queue(maxsize=256)
 
-	# Limit concurrency with a semaphore and use a 0.01 second or 10ms space 
-	# between requests to stay under 100 requests per second
+	# Limit concurrency with a semaphore, the request rate is handled by the limiter in get_reference_data,
+	# a token bucket that stays under polygon's 100 requests per second. Both belong to this run
 	semaphore = asyncio.Semaphore(20)
-	rate_limit_delay = 0.01
+	limiter = AsyncRateLimiter(95, 1)
 
-	# Create tasks for all tickers
-	tasks = [get_reference_data(ticker, date, semaphore) for ticker, date in payload_list]
+	async def fetch(date, tickers):
+		result_type, references = await get_reference_data(date, semaphore, limiter, session)
+		if result_type == 'success':
+			await raw_queue.put((date, tickers, references))
+		else:
+			await result_queue.put(("failed", date))
 
-	# Track the batch numbers separately for success and failed
-	success_batch_counter = 0
-	failed_batch_counter = 0
+	async def parse_worker():
+		# None is the shutdown signal, one per worker
+		while (item := await raw_queue.get()) is not None:
+			date, tickers, references = item
+			table = await asyncio.to_thread(build_reference_table, references, date, tickers)
+			await result_queue.put(("success", table))
 
-	# Process with rate limiting 
-	for task in tqdm.as_completed(tasks, desc="Fetching reference data", total=len(tasks)):
-		result_type, ref_data = await task
+	async with asyncio.TaskGroup() as tg:
+		writer = tg.create_task(write_checkpoints(result_queue, batch_size, checkpoint_dir, type_save))
+		workers = [tg.create_task(parse_worker()) for _ in range(n_parse_workers)]
 
-		# Handle the successful responses
-		if result_type == 'success':
-			# add to the list_of_ref_data
-			list_ref_data_buffer.append(ref_data)
-			
-			# Save the results every batch_size of successful requests
-			if len(list_ref_data_buffer) >= batch_size:
-				success_batch_counter += 1
-				checkpoint_file = checkpoint_dir / "success" / f"batch_{success_batch_counter:04d}.json"
-				checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
-				await save_checkpoint(list_ref_data_buffer, "json", checkpoint_file)
-				list_ref_data_buffer.clear()
+		# Create tasks for all dates and wait for the fetches to finish
+		tasks = [fetch(date, tickers) for date, tickers in payload.items()]
+		for task in tqdm.as_completed(tasks, desc="Fetching reference data", total=len(tasks)):
+			await task
 
+		# Shut the pipeline down in order, the workers drain raw_queue first, then the writer drains result_queue
+		for _ in workers:
+			await raw_queue.put(None)
+		await asyncio.gather(*workers)
+		await result_queue.put(None)
+
+	# report the failures that did not fill a batch
+	failure_log.flush()
+
+async def write_checkpoints(
+	result_queue: asyncio.Queue,
+	batch_size: int,
+	checkpoint_dir: Path,
+	type_save: str
+	):
+	"""
+	Writer task for process_tickers, buffers the results off result_queue and saves them every batch_size
+
+	For parquet every batch is appended as a row group to a single file per kind, opened once:
+		checkpoint_dir / "reference_data.parquet" and checkpoint_dir / "failed_dates.parquet"
+	json keeps the numbered batch_NNNN.json files in success/ and failed/
+	"""
+	writers = {}
+	if type_save == "parquet":
+		checkpoint_dir.mkdir(parents=True, exist_ok=True)
+		writers['success'] = pq.ParquetWriter(checkpoint_dir / "reference_data.parquet", REF_DATA_SCHEMA, compression='zstd')
+		writers['failed'] = pq.ParquetWriter(checkpoint_dir / "failed_dates.parquet", FAILED_SCHEMA, compression='zstd')
+
+	# Track the batch numbers separately for success and failed (json files)
+	batch_counters = {'success': 0, 'failed': 0}
+
+	async def flush(kind: str, table: pa.Table):
+		if writers:
+			# the encode + write is blocking, keep it off the event loop
+			await asyncio.to_thread(writers[kind].write_table, table)
 		else:
-			list_failed_refs.append(ref_data)
-			
-			# Save the failed results every batch_size
-			if len(list_failed_refs) >= batch_size:
-				failed_batch_counter += 1
-				checkpoint_file = checkpoint_dir / "failed" / f"batch_{failed_batch_counter:04d}.json"
-				checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
-				await save_checkpoint(list_failed_refs, "json", checkpoint_file)
-				list_failed_refs.clear() 
-
-		await asyncio.sleep(rate_limit_delay)
+			batch_counters[kind] += 1
+			checkpoint_file = checkpoint_dir / kind / f"batch_{batch_counters[kind]:04d}.{type_save}"
+			checkpoint_file.parent.mkdir(parents=True, exist_ok=True)
+			await save_checkpoint(table, type_save, checkpoint_file)
+
+	# Store the results, the successful responses are buffered as arrow tables and counted by rows
+	list_ref_data_buffer = []
+	buffered_rows = 0
+	list_failed_refs = []
+
+	try:
+		# None is put on the queue once everything upstream is done
+		while (item := await result_queue.get()) is not None:
+			result_type, ref_data = item
+
+			# Handle the successful responses
+			if result_type == 'success':
+				# add the table from this response to the buffer
+				list_ref_data_buffer.append(ref_data)
+				buffered_rows += ref_data.num_rows
+				
+				# Save the results every batch_size rows, concat_tables just collects the chunks without copying
+				if buffered_rows >= batch_size:
+					await flush('success', pa.concat_tables(list_ref_data_buffer))
+					list_ref_data_buffer.clear()
+					buffered_rows = 0
+
+			else:
+				list_failed_refs.append(ref_data)
+				
+				# Save the failed results every batch_size
+				if len(list_failed_refs) >= batch_size:
+					await flush('failed', failed_table(list_failed_refs))
+					list_failed_refs.clear() 
+
+		# Save whatever is left over in the buffers after the last full batch
+		if list_ref_data_buffer:
+			await flush('success', pa.concat_tables(list_ref_data_buffer))
+		if list_failed_refs:
+			await flush('failed', failed_table(list_failed_refs))
+
+	finally:
+		# closing writes the parquet footer, without it the file is unreadable
+		for writer in writers.values():
+			writer.close()
 
 async def get_reference_data(
-	ticker: str,
 	date,
-	semaphore: asyncio.Semaphore
+	semaphore: asyncio.Semaphore,
+	limiter: AsyncRateLimiter,
+	session: aiohttp.ClientSession
 	):
 	"""
+	Fetch every active ticker on date, the parsing happens in build_reference_table
+	Returns tuple: ("success", list of ticker result dicts) or ("failed", date)
 	"""
 	async with semaphore:
 		try:
-			def fetch_ref_data():
-				
-				ref_data_generator = client.list_tickers(
-					ticker=ticker,
-					date=date,
-					active="true",
-					order="asc",
-					limit="1000",
-					sort="ticker",
-				)
-			
-				# Convert generator into a list that we return to the awaited references variable
-				return list[bytes | RefData(ref_data_generator)]
-
-			# Call the fetch_ref_data function in a thread 
-			references = await asyncio.to_thread(fetch_ref_data)
-
-			# Transform the reference data into dataclass objects
-			# This happens AFTER fetch_ref_data() has returned
-			date_str = date.strftime('%Y-%m-%d') if isinstance(date, date) else str(date)
-			# Construct reference data objects of type RefData dataclass 
-			reference_objects = [
-				RefData(
-					ticker=getattr(reference, 'ticker', ''),
-					name=getattr(reference, 'name', ''),
-					market=getattr(reference, 'market', ''),
-					locale=getattr(reference, 'locale', ''),
-					primary_exchange=getattr(reference, 'primary_exchange', ''),
-					type=getattr(reference, 'type', ''),
-					active=getattr(reference, 'active', False),
-					currency_name=getattr(reference, 'currency_name', ''),
-					cik=getattr(reference, 'cik', ''),
-					composite_figi=getattr(reference, 'composite_figi', ''),
-					share_class_figi=getattr(reference, 'share_class_figi', ''),
-					last_updated_utc=getattr(reference, 'last_updated_utc', ''),
-					date_param=date_str
-				)
-				for reference in references
-			]
-
-			# Now return get_reference_data data class objects
-			return ("sucess", reference_objects)
-
-		# Catch the failed requests to track which tickers we did not get any name change info from 
+			url = TICKERS_URL
+			params = {
+				'date': str(date),
+				'active': 'true',
+				'order': 'asc',
+				'limit': 1000,
+				'sort': 'ticker',
+			}
+			references = []
+
+			# Follow the next_url cursor page by page on the shared session, next_url already carries the query
+			while url:
+				response = await get_json_with_retry(session, limiter, url, params)
+				references.extend(response.get('results', []))
+				url = response.get('next_url')
+				params = None
+
+			return ("success", references)
+
+		# Catch the failed requests to track which dates we did not get any reference data for
 		# for now we just send both failed for all types of failures
-		except BadResponse as e:
-			print(f"BadResponse for {ticker}: {e}")
-			return ("failed", ticker)
+		except aiohttp.ClientResponseError as e:
+			failure_log.add(date, f"BadResponse {e.status} {e.message}")
+			return ("failed", date)
 		except Exception as e:
 			# Catch any other exceptions (like network errors, etc.)
-			print(f"Error fetching splits for {ticker}: {e}")
-			return ("failed", ticker)
\ No newline at end of file
+			failure_log.add(date, repr(e))
+			return ("failed", date)
+
+def build_reference_table(
+	references: List,
+	date,
+	tickers: Set[str]
+	) -> pa.Table:
+	"""
+	Transform the reference data for one date into an arrow table, keeping only the tickers in our data
+
+	One list per RefData field instead of a dataclass per row
+	"""
+	columns = {name: [] for name in REF_DATA_FIELDS}
+	for reference in references:
+		if reference.get('ticker') not in tickers:
+			continue
+		for name in REF_DATA_API_FIELDS:
+			columns[name].append(reference.get(name, REF_DATA_DEFAULTS[name]))
+	columns['date_param'] = [str(date)] * len(columns['ticker'])
+
+	return pa.Table.from_pydict(columns, schema=REF_DATA_SCHEMA)
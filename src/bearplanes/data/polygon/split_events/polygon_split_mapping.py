@@ -1,6 +1,12 @@
+import numpy as np
 import pandas as pd
 from pandas.core import frame
 
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+ADJUSTED_PRICE_COLUMNS = ['adjusted_open', 'adjusted_high', 'adjusted_low', 'adjusted_close']
+# the columns of the ticker mapped OHLCV data map_splits needs
+MAPPED_HISTORY_COLUMNS = ['ticker', 'adjusted_ticker', 'date', 'open', 'high', 'low', 'close', 'volume']
+
 # Process to adjust
 
 # Assuming splits are sorted oldest to newest, but we apply cumulatively from newest backward
@@ -23,6 +29,39 @@ from pandas.core import frame
 # factor_prices = 15/1 = 15 → historical prices *= 15 (higher)
 # factor_vol = 1/15 ≈ 0.0667 → historical vol *= 0.0667 (lower)
 
+def load_mapped_history(
+    path,
+    columns=MAPPED_HISTORY_COLUMNS
+    ) -> pd.DataFrame:
+    """
+    Read the ticker mapped OHLCV parquet for map_splits
+
+    Only MAPPED_HISTORY_COLUMNS are read by default (columns=None reads everything), and the ticker
+    columns are dictionary decoded straight to categories instead of millions of python strings.
+    map_splits then codes the rows against the split tickers through the categories alone.
+    """
+    return pd.read_parquet(path, engine='pyarrow', columns=columns, read_dictionary=['ticker', 'adjusted_ticker'])
+
+def write_split_adjusted(
+    df: pd.DataFrame,
+    path
+    ) -> None:
+    """
+    Write the map_splits output to parquet
+
+    zstd level 3 compresses the float columns well at snappy-like speed, and 1M row groups give
+    column pruned and filtered readers something to skip instead of one huge row group.
+    """
+    df.to_parquet(
+        path,
+        engine='pyarrow',
+        compression='zstd',
+        compression_level=3,
+        row_group_size=1_000_000,
+        use_dictionary=['ticker', 'adjusted_ticker'],
+        index=False
+    )
+
 def map_splits(
     split_info: pd.DataFrame(),
     historical_data: pd.DataFrame()
@@ -32,8 +71,11 @@ def map_splits(
         split_info - roughly 4100 rows
         historical_data - roughly 20M rows 
     
-    We will also be iterating through series of stock data on grouped by adjusted_ticker
-    this is probably around 10-15k individual series based on unique tickers
+    Every row gets one cumulative factor (the product of every split of its ticker after the row's date)
+    from a single binary search over the splits laid out by (ticker, date), no per ticker or per split loop
+
+    historical_data is not modified or copied, the returned frame is a new DataFrame that shares the
+    input's columns and only allocates the five adjusted_* columns
 
     split_info.head()
                 ticker        date  split_from  split_to
@@ -43,53 +85,98 @@ def map_splits(
         3   DLPN  2020-11-27         5.0       1.0
         4   DLPN  2024-10-16         2.0       1.0
     """
-    # Confirm the split info will be sorted by date in descending order, older dates first
-    split_info = split_info.sort_values(by='date', ascending=False)
-
-    df_copy = historical_data.copy()
-
-    # Initialize adjusted columns by copying original values
-    # This preserves original data and creates new adjusted columns
-    # These will be adjusted futher in the method
-    df_copy['adjusted_open'] = df_copy['open'].copy()
-    df_copy['adjusted_high'] = df_copy['high'].copy()
-    df_copy['adjusted_low'] = df_copy['low'].copy()
-    df_copy['adjusted_close'] = df_copy['close'].copy()
-    df_copy['adjusted_volume'] = df_copy['volume'].copy()
-
-    # Group the OHLCV data in the historical dataframe into series by each ticker/(companies) common "adjusted_ticker"
-    grouped_data = df_copy.groupby('adjusted_ticker')
-
-    # Iterate through each row of the splits dataframe using itertuples (faster than iterrows and we dont need to modify the splits dataframe)
-    for row in split_info.itertuples():
-        # access the attributes of that row (tuple)
-        split_ticker = row.ticker
-        split_date = row.date
-        split_from = row.split_from
-        split_to = row.split_to
-
-        # Calculate the adjustment ratios
-        # General formula (same for forward and reverse):
-        adjustment_factor_prices = split_from / split_to
-        adjustment_factor_vol = split_to / split_from
-
-        # For each series 
-        for _, series in grouped_data:
-            # Check if this series contains the ticker we're looking for 
-            if split_ticker in series['ticker'].values:
-                # Create mask on the series (already filtered to this adjusted_ticker)
-                # No need to check adjusted_ticker since we're already in that group
-                mask = (series['ticker'] == split_ticker) & (series['date'] < split_date)
-                
-                # Apply adjustments directly using the mask
-                # The mask has indices from df_copy (since series is a view), so pandas aligns correctly
-                df_copy.loc[mask, 'adjusted_open'] *= adjustment_factor_prices
-                df_copy.loc[mask, 'adjusted_high'] *= adjustment_factor_prices
-                df_copy.loc[mask, 'adjusted_low'] *= adjustment_factor_prices
-                df_copy.loc[mask, 'adjusted_close'] *= adjustment_factor_prices
-                df_copy.loc[mask, 'adjusted_volume'] *= adjustment_factor_vol
-
-
-    return df_copy
+    # Lay the splits out ticker by ticker, oldest first within each ticker
+    split_codes, split_tickers = pd.factorize(split_info['ticker'])
+    # compare dates as int64 days since epoch, plain integer compares for searchsorted
+    split_days = _epoch_days(pd.to_datetime(split_info['date']))
+    order = np.lexsort((split_days, split_codes))
+    split_codes = split_codes[order]
+    split_keys = _ticker_day_keys(split_codes, split_days[order])
+
+    # factor of each split position = product of that split and every later split of the same ticker
+    price_ratios = (split_info['split_from'] / split_info['split_to']).to_numpy()[order]
+    volume_ratios = (split_info['split_to'] / split_info['split_from']).to_numpy()[order]
+    price_factors = _segment_reverse_cumprod(split_codes, price_ratios)
+    volume_factors = _segment_reverse_cumprod(split_codes, volume_ratios)
+
+    # code every row against the split tickers with one hash lookup, -1 for tickers that never split
+    row_codes = pd.Categorical(historical_data['ticker'], categories=split_tickers).codes
+    split_rows = np.flatnonzero(row_codes >= 0)
+    row_codes = row_codes[split_rows].astype(np.int64)
+    row_keys = _ticker_day_keys(row_codes, _epoch_days(historical_data['date'].iloc[split_rows]))
+
+    # One global binary search: the first split after each row's (ticker, date), if it belongs to the
+    # same ticker the row is adjusted by that split and all the later ones, otherwise not at all
+    first_after = np.searchsorted(split_keys, row_keys, side='right')
+    # pad one past the end so rows after the last split of the last ticker land on a non matching code
+    same_ticker = np.append(split_codes, -1)[first_after] == row_codes
+    price_factor = np.where(same_ticker, np.append(price_factors, 1.0)[first_after], 1.0)
+    volume_factor = np.where(same_ticker, np.append(volume_factors, 1.0)[first_after], 1.0)
+
+    # Spread the factors over every row (1 for rows without a later split), each adjusted column is then
+    # a single multiply of the original column written straight into its output, no copy first
+    price_factor_all = np.ones(len(historical_data))
+    price_factor_all[split_rows] = price_factor
+    volume_factor_all = np.ones(len(historical_data))
+    volume_factor_all[split_rows] = volume_factor
+
+    # the four price outputs share one (4, n_rows) array, each row of it is a contiguous column
+    adjusted_prices = np.empty((len(PRICE_COLUMNS), len(historical_data)))
+    for values, col in zip(adjusted_prices, PRICE_COLUMNS):
+        np.multiply(historical_data[col].to_numpy(), price_factor_all, out=values)
+    # float, the volume factor is fractional for reverse splits
+    adjusted_volume = historical_data['volume'].to_numpy() * volume_factor_all
+
+    # attach the adjusted columns to a shallow copy, the original columns are shared rather than copied
+    # (assign() or concat() would deep copy the whole frame first)
+    result = historical_data.copy(deep=False)
+    for col, values in zip(ADJUSTED_PRICE_COLUMNS, adjusted_prices):
+        result[col] = values
+    result['adjusted_volume'] = adjusted_volume
+
+    return result
+
+def _epoch_days(dates: pd.Series) -> np.ndarray:
+    """
+    Dates as int64 days since 1970-01-01
+    """
+    return dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').view('i8')
 
+def _ticker_day_keys(
+    codes: np.ndarray,
+    days: np.ndarray
+    ) -> np.ndarray:
+    """
+    Pack (ticker code, epoch day) into one int64 that sorts like the pair
+    """
+    return (codes.astype(np.int64) << 32) + (days + 2**31)
+
+def _segment_reverse_cumprod(
+    codes: np.ndarray,
+    ratios: np.ndarray
+    ) -> np.ndarray:
+    """
+    Reverse cumulative product of ratios within each run of equal codes
 
+    Position i gets ratios[i] * ratios[i + 1] * ... up to the end of its run. Runs are a ticker's
+    splits (a handful at most), so this loops over the position counted from the run's end and
+    multiplies every run at once.
+    """
+    n = len(codes)
+    factors = ratios.astype(np.float64, copy=True)
+    if n == 0:
+        return factors
+
+    # index of the last position of each run, then how far each position sits from it
+    run_end = np.empty(n, dtype=bool)
+    run_end[-1] = True
+    np.not_equal(codes[:-1], codes[1:], out=run_end[:-1])
+    positions = np.arange(n)
+    last = np.flatnonzero(run_end)
+    from_end = last[np.searchsorted(last, positions)] - positions
+
+    for step in range(1, from_end.max() + 1):
+        at = np.flatnonzero(from_end == step)
+        factors[at] *= factors[at + 1]
+
+    return factors
@@ -1,24 +1,29 @@
 import asyncio
-import json
 import os
 import sys
-from dataclasses import asdict, dataclass
-from typing import Any, List, Tuple
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
 
+import aiohttp
+import numpy as np
 import pandas as pd
-from dotenv import load_dotenv
-from polygon import RESTClient
-from polygon.exceptions import BadResponse
-from polygon.rest.models.splits import Split
-from rich import print
 from tqdm.asyncio import tqdm
 
 # Add parent directory to path to import utils module
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import add_datetime
+from utils import (AsyncRateLimiter, FailureLog, FileCache, create_session,
+                   get_json_with_retry)
 
-load_dotenv()
-client = RESTClient(os.getenv("POLYGON_API_KEY"))
+SPLITS_URL = "https://api.polygon.io/v3/reference/splits"
+# default location of the splits cache used by process_tickers_cached
+SPLITS_CACHE_PATH = Path('~/.cache/polygon_splits.parquet')
+
+# failed requests are reported in batches instead of a print per failure
+failure_log = FailureLog("split event")
+# responses already fetched on an earlier run are read from disk instead of the API
+cache = FileCache()
 
 # Data class to hold split info
 @dataclass (frozen = True, slots = True)
@@ -29,31 +34,37 @@ class Splits:
     split_to: float    # Polygon returns as number - can be int or float. Use float to preserve all precision.
 
 async def process_tickers(
-    tickers_list: List[str]
+    tickers_list: List[str],
+    session: Optional[aiohttp.ClientSession] = None
     ) -> Tuple[List[Splits], List[str]]:
     """
     Process multiple tickers to fetch their split events from Polygon API.
     
     Args:
         tickers_list: List of ticker symbols to fetch split events for
+        session: shared session from create_session, otherwise one is opened and closed here
         
     Returns:
         Tuple of (list_of_splits, list_of_failed_tickers):
         - list_of_splits: List of Splits dataclass objects containing split event data
         - list_of_failed_tickers: List of ticker symbols that failed to fetch
     """
+    if session is None:
+        async with create_session() as session:
+            return await process_tickers(tickers_list, session)
+
     list_of_splits = []
     list_of_failed = []
 
-    # Limit concurrency with a semaphore and use a 0.01 second or 10ms space 
-    # between requests to stay under 100 requests per second
+    # Limit concurrency with a semaphore, the request rate is handled by the limiter in get_split_events
+    # (a token bucket that stays under polygon's 100 requests per second, one per run)
+    # so the results are drained without any sleep between them
     semaphore = asyncio.Semaphore(20)
-    rate_limit_delay = 0.01
+    limiter = AsyncRateLimiter(95, 1)
 
     # Create tasks for all tickers
-    tasks = [get_split_events(ticker, semaphore) for ticker in tickers_list]
+    tasks = [get_split_events(ticker, semaphore, limiter, session) for ticker in tickers_list]
 
-    # Process with rate limiting
     for task in tqdm.as_completed(tasks, desc="Fetching split events", total=len(tasks)):
         # Get the data from each call
         result_type, split_event = await task
@@ -65,66 +76,150 @@ async def process_tickers(
         else:
             list_of_failed.append(split_event)
 
-        await asyncio.sleep(rate_limit_delay)
+    # report the failures that did not fill a batch
+    failure_log.flush()
 
     return list_of_splits, list_of_failed
 
 async def get_split_events(
     ticker: str,
-    semaphore: asyncio.Semaphore
+    semaphore: asyncio.Semaphore,
+    limiter: AsyncRateLimiter,
+    session: aiohttp.ClientSession
     ) -> Tuple[str, Any]:
     """
     Fetches split events for a single ticker from Polygon API.
     Returns tuple: ("success", list_of_splits) or ("failed", ticker)
     
-    Note: client.list_splits() returns a generator, so we need to convert it to a list
-    by wrapping it in a function that consumes the generator.
+    Requests the splits endpoint directly on the shared session and follows next_url
+    for tickers with more than one page.
     """
     async with semaphore:
         try:
-            # Create a helper function that calls list_splits and converts generator to list
-            # This is needed because asyncio.to_thread() expects a callable function,
-            # not the result of calling that function
-            def fetch_splits():
-                # list_splits() returns a generator, so we convert it to a list
-                splits_generator = client.list_splits(
-                    ticker=ticker,
-                    execution_date_gte="2016-01-01",
-                    order="asc",
-                    limit=1000,  # limit should be an int, not a string
-                    sort="execution_date"
-                )
-                # Convert generator to list
-                # This return only exits fetch_splits(), NOT get_split_events()
-                return list[bytes | Split](splits_generator)
-            
-            # Run the synchronous call in a thread pool
-            # fetch_splits() executes here and returns a list of Split objects
-            # The return inside fetch_splits() only exits that nested function,
-            # execution continues here in get_split_events()
-            splits = await asyncio.to_thread(fetch_splits)
-            
-            # Transform the raw Split objects into Splits dataclass objects
-            # This happens AFTER fetch_splits() has returned
+            url = SPLITS_URL
+            params = {
+                'ticker': ticker,
+                'execution_date.gte': "2016-01-01",
+                'order': "asc",
+                'limit': 1000,
+                'sort': "execution_date"
+            }
+            results = cache.get('splits', ticker, params)
+
+            if results is None:
+                cache_params = params
+                results = []
+
+                # next_url already carries the query, only the first page sends params
+                while url:
+                    response = await get_json_with_retry(session, limiter, url, params)
+                    results.extend(response.get('results', []))
+                    url = response.get('next_url')
+                    params = None
+
+                cache.set('splits', ticker, results, cache_params)
+
+            # Transform the raw split dicts into Splits dataclass objects
             split_objects = [
                 Splits(
-                    ticker=split.ticker,
-                    date=split.execution_date,
-                    split_from=split.split_from,
-                    split_to=split.split_to
+                    ticker=split['ticker'],
+                    date=split['execution_date'],
+                    split_from=split['split_from'],
+                    split_to=split['split_to']
                 )
-                for split in splits
+                for split in results
             ]
-            
-            # Now return from get_split_events() with the transformed data
+
             return ("success", split_objects)
-        # Catch the failed requests to track which tickers we did not get any name change info from    
-        except BadResponse as e:
-            print(f"BadResponse for {ticker}: {e}")
+        # Catch the failed requests to track which tickers we did not get any split info from
+        except aiohttp.ClientResponseError as e:
+            failure_log.add(ticker, f"BadResponse {e.status} {e.message}")
             return ("failed", ticker)
         except Exception as e:
             # Catch any other exceptions (like network errors, etc.)
-            print(f"Error fetching splits for {ticker}: {e}")
+            failure_log.add(ticker, repr(e))
             return ("failed", ticker)
 
+def splits_to_dataframe(list_of_splits: List[Splits]) -> pd.DataFrame:
+    """
+    Build the split_info frame map_splits expects from the Splits returned by process_tickers
+
+    Built from one array per column rather than pd.DataFrame(asdict(split) for split in ...),
+    which allocates a dict per split and goes through pandas' record inference.
+    """
+    n = len(list_of_splits)
+
+    return pd.DataFrame({
+        'ticker': [split.ticker for split in list_of_splits],
+        'date': [split.date for split in list_of_splits],
+        'split_from': np.fromiter((split.split_from for split in list_of_splits), dtype=np.float64, count=n),
+        'split_to': np.fromiter((split.split_to for split in list_of_splits), dtype=np.float64, count=n)
+    })
+
+async def process_tickers_cached(
+    tickers_list: List[str],
+    cache_path=SPLITS_CACHE_PATH,
+    session: Optional[aiohttp.ClientSession] = None,
+    ttl_days: float = 90
+    ) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    process_tickers with an on disk cache, only tickers not fetched within ttl_days hit Polygon
+
+    Past splits do not change, but a ticker can split again after it was fetched, so every ticker is
+    refetched once its entry is older than ttl_days (the FileCache default). The splits are kept in
+    cache_path and each fetched ticker (including the ones without any splits) with its fetch time
+    in <cache_path>.tickers.parquet. Failed tickers keep their old entry and get retried on the next run.
+
+    Both caches are kept on purpose: the FileCache under get_split_events holds the raw response per
+    ticker for every process_tickers caller, this one keeps the whole splits frame in one parquet so a run
+    over thousands of tickers reads one file instead of a json file per ticker. A refetch here can still be
+    answered by the FileCache, that entry is younger than its own ttl so the splits are never older than ttl_days.
+
+    Returns:
+        Tuple of (splits DataFrame for tickers_list as built by splits_to_dataframe, list_of_failed_tickers)
+    """
+    cache_path = Path(cache_path).expanduser()
+    tickers_path = cache_path.with_suffix('.tickers.parquet')
+
+    if cache_path.exists() and tickers_path.exists():
+        cached = pd.read_parquet(cache_path, engine='pyarrow')
+        fetched = pd.read_parquet(tickers_path, engine='pyarrow')
+        # a tickers file from before fetch times were recorded counts as stale
+        if 'fetched_at' not in fetched.columns:
+            fetched['fetched_at'] = 0.0
+        fetched_at = dict(zip(fetched['ticker'], fetched['fetched_at']))
+    else:
+        cached = splits_to_dataframe([])
+        fetched_at = {}
+
+    now = time.time()
+    ttl_seconds = ttl_days * 86_400
+    missing = [
+        ticker for ticker in dict.fromkeys(tickers_list)
+        if now - fetched_at.get(ticker, float('-inf')) > ttl_seconds
+    ]
+    list_of_failed = []
+
+    if missing:
+        list_of_splits, list_of_failed = await process_tickers(missing, session)
+
+        # everything asked for minus the failures counts as fetched, even when it had no splits,
+        # their old splits are replaced by the fresh ones
+        failed = set(list_of_failed)
+        refreshed = [ticker for ticker in missing if ticker not in failed]
+        fetched_at.update(dict.fromkeys(refreshed, now))
+
+        cached = pd.concat(
+            [cached[~cached['ticker'].isin(refreshed)], splits_to_dataframe(list_of_splits)],
+            ignore_index=True
+        )
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cached.to_parquet(cache_path, engine='pyarrow', index=False)
+        pd.DataFrame({
+            'ticker': list(fetched_at),
+            'fetched_at': np.fromiter(fetched_at.values(), dtype=np.float64, count=len(fetched_at))
+        }).to_parquet(tickers_path, engine='pyarrow', index=False)
+
+    splits = cached[cached['ticker'].isin(tickers_list)].reset_index(drop=True)
 
+    return splits, list_of_failed
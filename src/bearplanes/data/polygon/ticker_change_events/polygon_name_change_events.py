@@ -1,22 +1,26 @@
 import asyncio
+import json
 import os
-import pickle
+import sys
 from dataclasses import dataclass, field
 from datetime import date
-from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
+import aiohttp
 import pandas as pd
-from dotenv import load_dotenv
-from numpy import result_type
-from polygon import RESTClient
-from polygon.exceptions import BadResponse
-from rich import print
-from tqdm import tqdm
 from tqdm.asyncio import tqdm
 
-load_dotenv()
-client = RESTClient(os.getenv("POLYGON_API_KEY"))
+# Add parent directory to path to import utils module
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from utils import (AdmissionController, AsyncRateLimiter, FailureLog,
+                   FileCache, create_session, get_json_with_retry)
+
+EVENTS_URL = "https://api.polygon.io/vX/reference/tickers/{ticker}/events"
+
+# failed requests are reported in batches instead of a print per failure
+failure_log = FailureLog("ticker event")
+# responses already fetched on an earlier run are read from disk instead of the API
+cache = FileCache()
 
 @dataclass(frozen=True, slots=True)
 class TickerEvent:
@@ -27,59 +31,96 @@ class TickerEvent:
     events: List[Dict[str, Any]] = field(default_factory=list)
 
 async def process_tickers(
-    tickers_list: List[str]):
+    tickers_list: List[str],
+    session: Optional[aiohttp.ClientSession] = None,
+    checkpoint_path: Optional[str] = None):
     """
     Get ticker events for a list of tickers and handle errors properly.
     Returns tuple of (successful_events, failed_tickers) which are lists.
+
+    Pass a session from create_session to share it across calls, otherwise one is opened and closed here.
+
+    With a checkpoint_path every successful event is appended to that JSONL file as it arrives. On the next
+    run the events already in the file are loaded, their tickers are skipped and only the rest are requested,
+    so a crash or Ctrl-C only loses the requests that were in flight. Failed tickers are not written and get retried.
     """
+    if session is None:
+        async with create_session() as session:
+            return await process_tickers(tickers_list, session, checkpoint_path)
+
     list_of_events = []
     list_failed_tickers = []
-    # We also want to track and return a set of each ticker we have successfully processed through the API, using this to track what tickers we 
-    # need to send in the future to complete our data set or resume a cancelled or failed request (not currently implemented)
-    set_of_processed_tickers = {}
 
-    # Limit concurrency with a semaphore and use a 0.01 second or 10ms space 
-    # between requests to stay under 100 requests per second
-    semaphore = asyncio.Semaphore(20)
-    rate_limit_delay = 0.01
+    # Resume from the checkpoint, the tickers already in it are not requested again
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        line = ''
+        with open(checkpoint_path) as f:
+            for line in f:
+                try:
+                    list_of_events.append(json.loads(line))
+                except ValueError:
+                    # a line cut off by a killed run, that ticker is simply requested again
+                    continue
+        # start the new events on a fresh line after a cut off one
+        if line and not line.endswith('\n'):
+            with open(checkpoint_path, 'a') as f:
+                f.write('\n')
+        processed = {event['ticker'] for event in list_of_events}
+        tickers_list = [ticker for ticker in tickers_list if ticker not in processed]
+
+    # Limit concurrency, starting at 20 in flight and adapting to 429s, the request rate is handled
+    # by the limiter in get_ticker_event (a token bucket that stays under polygon's 100 requests per second).
+    # Both belong to this run
+    admission = AdmissionController(20)
+    limiter = AsyncRateLimiter(95, 1)
 
     # Create tasks for all tickers
-    tasks = [get_ticker_event(ticker, semaphore) for ticker in tickers_list]
-   
-    # Process with rate limiting
-    # for task in asyncio.as_completed(tasks):
-    for task in tqdm.as_completed(tasks, desc="Fetching ticker events", total=len(tasks)):
-        # Get the result type and data from each call
-        result_type, result_data = await task
-        
-        # If the result was success append to list_of_events
-        if result_type == "success":
-            # Want to save each result_data event as well during the run incase we drop off or want to avoid calling the API again 
-            # print(f"PRINTING WHAT AN RESULT_DATA EVENT LOOKS LIKE: {result_data}")
-            # will be implementing later in development
-
-            # Add to our list of events list
-            list_of_events.append(result_data)
-        else:
-            list_failed_tickers.append(result_data)
-
-        # Basic rate limiting to stay under 100 req/sec
-        await asyncio.sleep(rate_limit_delay)
+    tasks = [get_ticker_event(ticker, admission, limiter, session) for ticker in tickers_list]
+
+    checkpoint = open(checkpoint_path, 'a') if checkpoint_path is not None else None
+    try:
+        # Drain the results as they complete
+        for task in tqdm.as_completed(tasks, desc="Fetching ticker events", total=len(tasks)):
+            # Get the result type and data from each call
+            result_type, result_data = await task
+
+            # If the result was success append to list_of_events
+            if result_type == "success":
+                list_of_events.append(result_data)
+                # save each event as it arrives so a dropped run can resume from here
+                if checkpoint is not None:
+                    checkpoint.write(json.dumps(result_data, default=str) + '\n')
+                    checkpoint.flush()
+            else:
+                list_failed_tickers.append(result_data)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    # report the failures that did not fill a batch
+    failure_log.flush()
     
     return list_of_events, list_failed_tickers
 
 async def get_ticker_event(
     ticker: str, 
-    semaphore: asyncio.Semaphore
+    admission: AdmissionController,
+    limiter: AsyncRateLimiter,
+    session: aiohttp.ClientSession
     ) -> Tuple[str, Any]:
     """
     Processes and returns the info from one ticker event at a time
     Returns tuple: ("success", event_dict) or ("failed", ticker)
     """
-    async with semaphore:
+    async with admission:
+        cached = cache.get('ticker_events', ticker)
+        if cached is not None:
+            return ("success", cached)
+
         try:
-            # Run the synchronous RESTClient call in a thread
-            events = await asyncio.to_thread(client.get_ticker_events, ticker)
+            # Request the events endpoint directly on the shared session
+            response = await get_json_with_retry(session, limiter, EVENTS_URL.format(ticker=ticker), admission=admission)
+            events = response.get('results', {})
             # Construct and event dictionary which holds:
                 # 1) the ticker we passed in 
                 # 2) the name of the event (should simply be events)
@@ -88,24 +129,31 @@ async def get_ticker_event(
                 # 5) the list of events
             event_dict = {
                 'ticker': ticker, 
-                'name': getattr(events, 'name', None),
-                'composite_figi': getattr(events, 'composite_figi', None),
-                'cik': getattr(events, 'cik', None),
-                'events': getattr(events, 'events', [])
+                'name': events.get('name'),
+                'composite_figi': events.get('composite_figi'),
+                'cik': events.get('cik'),
+                'events': events.get('events', [])
             }
+            cache.set('ticker_events', ticker, event_dict)
             return ("success", event_dict)
         # Catch the failed requests to track which tickers we did not get any name change info from    
-        except BadResponse as e:
-            print(f"BadResponse for {ticker}: {e}")
+        except aiohttp.ClientResponseError as e:
+            failure_log.add(ticker, f"BadResponse {e.status} {e.message}")
+            return ("failed", ticker)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            failure_log.add(ticker, repr(e))
             return ("failed", ticker)
         
-def build_ticker_mapping(events_list: []):
+def build_ticker_mapping(events_list: List[Dict[str, Any]]) -> Dict[str, List[Tuple[str, Any]]]:
     """
     Build a mapping of all historical tickers to their current ticker.
     Returns a dictionary where key=historical_ticker, value=current_ticker
 
     """
     reverse_mapping = {}
+    # the date single events get, kept as a date object, prepare_mapping_dataframe parses
+    # it together with polygon's date strings and there is no format/re-parse round trip
+    today = date.today()
     
     # Iterate through the list of event dictionaries
     for event_data in events_list:
@@ -114,24 +162,47 @@ def build_ticker_mapping(events_list: []):
         # Get the events list for the ticker
         events = event_data.get('events', [])
 
-        # Create a list to store the historical tickers
-        historical_tickers = []
-        
-        # Add all historical tickers from events
-        for event in events:
-            historical_ticker = event.get('ticker_change', {}).get('ticker')
-            historical_date = event.get('date')
-            if len(events) <= 1:
-                # If there is only one event returned in the 
-                historical_date = date.today().strftime('%Y-%m-%d')
-            if historical_ticker:
-                # Add the historical ticker to a list of all historical tickers (including the current ticker)
-                historical_tickers.append((historical_ticker, historical_date))
-        
-        reverse_mapping[current_ticker] = historical_tickers
+        # If there is only one event returned it is dated today
+        single_event_date = today if len(events) <= 1 else None
+
+        # Add all historical tickers from events (including the current ticker), one pass that skips
+        # events without a ticker_change ticker, the walrus avoids a second .get chain per event
+        reverse_mapping[current_ticker] = [
+            (tc['ticker'], single_event_date or event.get('date'))
+            for event in events
+            if (tc := event.get('ticker_change')) and tc.get('ticker')
+        ]
 
     return reverse_mapping
 
+def build_mapping_dataframe(events_list: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Same mapping as build_ticker_mapping but built directly in the long format map_symbols joins on,
+    one row per (current_ticker, historical_ticker, change_date) with change_date parsed once as datetime64.
+
+    Can be passed to map_symbols in place of the reverse_mapping dictionary.
+    """
+    today = date.today()
+    rows = []
+
+    for event_data in events_list:
+        current_ticker = event_data['ticker']
+        events = event_data.get('events', [])
+
+        # same rule as build_ticker_mapping, a single event is dated today
+        single_event_date = today if len(events) <= 1 else None
+        rows.extend(
+            (current_ticker, tc['ticker'], single_event_date or event.get('date'))
+            for event in events
+            if (tc := event.get('ticker_change')) and tc.get('ticker')
+        )
+
+    mapping_df = pd.DataFrame(rows, columns=['current_ticker', 'historical_ticker', 'change_date'])
+    # polygon dates are all YYYY-MM-DD, the explicit format takes the ISO fast path (today's date object passes through as is)
+    mapping_df['change_date'] = pd.to_datetime(mapping_df['change_date'], format='%Y-%m-%d', cache=True)
+
+    return mapping_df
+
 
 
     # # currently testing the endpoint on these tickers
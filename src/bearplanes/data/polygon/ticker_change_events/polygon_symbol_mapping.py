@@ -1,6 +1,7 @@
+import os
+
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
 #EXAMPLE WALKTHROUGH
 # OUR MAPPING:
@@ -18,6 +19,9 @@ def prepare_mapping_dataframe(
     ) -> pd.DataFrame:
     """ Converts the reverse_mapping dictionary into a dataframe
 
+    Also accepts the dataframe from build_mapping_dataframe, which is already in the long format
+    below and only needs the start_date filter.
+
     Format Before (Examples):
 
     KVP:    
@@ -31,6 +35,9 @@ def prepare_mapping_dataframe(
         Mapping: (<class 'str'>, <class 'list'>)
 
 
+    The change dates can be YYYY-MM-DD strings or datetime.date objects (build_ticker_mapping dates
+    single events with date.today()), both parse in the same to_datetime call.
+
     Format After:
 
     Long format (what we want)
@@ -47,100 +54,207 @@ def prepare_mapping_dataframe(
     if start_date is not None:
         start_date = pd.to_datetime(start_date).normalize()
 
-    # Create a list of dictionary objects to store the information we will convert into a dataframe
-    # this is faster than concating/appending each row to the dataframe in the loop
-    list_of_ticker_changes = []
+    # Already flattened by build_mapping_dataframe
+    if isinstance(reverse_mapping, pd.DataFrame):
+        if start_date is None:
+            return reverse_mapping
+        return reverse_mapping[reverse_mapping['change_date'] >= start_date].reset_index(drop=True)
 
-    # Add progress bar for processing ticker mappings
-    for current_ticker, history_list_of_tuples in tqdm(reverse_mapping.items(), desc="Preparing mapping dataframe", unit="ticker"):
-        
-        # Loop through each tuple in the list for this ticker
+    # One flat list per column, the frame is then built straight from the columns
+    # instead of a dict per row going through pandas' record inference
+    current_tickers = []
+    historical_tickers = []
+    change_dates = []
+
+    for current_ticker, history_list_of_tuples in reverse_mapping.items():
+        # Loop through each tuple in the list for this ticker, the dates are parsed below in one go
         for historical_ticker, change_date in history_list_of_tuples:
+            current_tickers.append(current_ticker)
+            historical_tickers.append(historical_ticker)
+            change_dates.append(change_date)
+
+    mapping_df = pd.DataFrame({
+        'current_ticker': current_tickers,
+        'historical_ticker': historical_tickers,
+        'change_date': change_dates
+    }, dtype=object)
 
-            # Convert date to Timestamp
-            if not isinstance(change_date, pd.Timestamp):
-                change_date = pd.to_datetime(change_date).normalize()
-
-            # Filter out dates (and thereby name change events) that happened
-            # before our historical OHLCV data begins (decreases the number of operations
-            # we have to do later in map_symbols)
-            if start_date is not None and change_date < start_date:
-                continue # continue will skip the tuple
-
-            # Add to our list 
-            list_of_ticker_changes.append({
-                'current_ticker': current_ticker,
-                'historical_ticker': historical_ticker,
-                'change_date': change_date
-            })
-        
-    # Convert the list 
-    mapping_df = pd.DataFrame(list_of_ticker_changes)
+    # Convert the dates to Timestamps once for the whole column instead of a to_datetime call per tuple,
+    # cache=True parses each distinct date string a single time
+    mapping_df['change_date'] = pd.to_datetime(mapping_df['change_date'], format='ISO8601', cache=True).dt.normalize()
+
+    # Filter out dates (and thereby name change events) that happened
+    # before our historical OHLCV data begins (decreases the number of operations
+    # we have to do later in map_symbols)
+    if start_date is not None:
+        mapping_df = mapping_df[mapping_df['change_date'] >= start_date].reset_index(drop=True)
 
     return mapping_df
 
+def write_sorted_history(
+    historical_data: pd.DataFrame,
+    path
+    ) -> None:
+    """
+    Write the OHLCV data to parquet sorted by ticker and date, ready for map_symbols
+
+    The sort is done once here instead of on every map_symbols run, ticker is dictionary encoded so it
+    reads back as a category, and the 1M row groups keep the file readable in pieces.
+    """
+    historical_data = historical_data.sort_values(['ticker', 'date'], kind='stable', ignore_index=True)
+    historical_data.to_parquet(
+        path,
+        engine='pyarrow',
+        compression='zstd',
+        row_group_size=1_000_000,
+        use_dictionary=['ticker'],
+        index=False
+    )
+
 def map_symbols(
     reverse_mapping_dict: {},
-    historical_data: pd.DataFrame,
+    historical_data,
     start_date: str
     ) -> pd.DataFrame:
     """ 
-        Takes a symbol mapping dataframe and OHLCV dataframe and returns the dataframe with a mapped symbols column titled 
-        'adjusted_ticker'.
-    """
+        Takes a symbol mapping (the reverse_mapping dict or the build_mapping_dataframe dataframe) and OHLCV dataframe
+        and returns the dataframe with a mapped symbols column titled 'adjusted_ticker'.
 
-    # Copy the original dataframe to preserve all columns
-    print("Creating copy of dataframe")
-    historical_data = historical_data.copy()
+        historical_data can also be the path of a parquet written by write_sorted_history, ticker is then
+        read straight into a category and the data comes in already sorted.
+
+        historical_data itself is left untouched, the result is a new frame sorted by ticker and date.
+        ticker and adjusted_ticker come back as categories sharing one dtype.
+    """
+    if isinstance(historical_data, (str, os.PathLike)):
+        historical_data = pd.read_parquet(historical_data, engine='pyarrow', read_dictionary=['ticker'])
 
     # convert mapping dictionary to Dataframe
     mapping_df = prepare_mapping_dataframe(reverse_mapping_dict, start_date)
 
-    # Sort historical_data by ticker and date for merge_asof
-    # CRITICAL: merge_asof requires the join key (date) to be sorted within each group (ticker)
-    print("Sorting historical data for merge_asof...")
-    with tqdm(total=1, desc="Sorting historical data", unit="operation") as pbar:
-        historical_data_sorted = historical_data.sort_values(['ticker', 'date'], kind='stable').reset_index(drop=True)
-        pbar.update(1)
+    # Put all the ticker columns on one shared categorical dtype, the by-ticker matching below
+    # then compares small int codes instead of hashing 23M python strings
+    ticker_dtype = pd.CategoricalDtype(
+        categories=pd.Index(historical_data['ticker'].unique())
+        .union(mapping_df['historical_ticker'].unique())
+        .union(mapping_df['current_ticker'].unique())
+    )
+    # assign, the mapping frame may be the caller's build_mapping_dataframe output
+    mapping_df = mapping_df.assign(
+        historical_ticker=mapping_df['historical_ticker'].astype(ticker_dtype),
+        current_ticker=mapping_df['current_ticker'].astype(ticker_dtype)
+    )
+
+    # Recode ticker to ticker_dtype by value on a shallow copy, the input's other columns are shared.
+    # A category ticker (run_cleaning, write_sorted_history) goes through set_categories: astype treats
+    # unordered dtypes with the same categories in another order as equal and would keep the old codes
+    historical_data_sorted = historical_data.copy(deep=False)
+    if isinstance(historical_data['ticker'].dtype, pd.CategoricalDtype):
+        historical_data_sorted['ticker'] = historical_data['ticker'].cat.set_categories(ticker_dtype.categories)
+    else:
+        historical_data_sorted['ticker'] = historical_data['ticker'].astype(ticker_dtype)
+
+    # Sort by ticker and date, the order the mapped data is returned in. ticker_dtype's categories are
+    # sorted, so sorting by the codes sorts by the ticker strings. The sort builds a new frame
+    # (ignore_index instead of a reset_index copy), data that comes in sorted (e.g. from
+    # write_sorted_history) skips it and only gets a fresh index
+    if _is_sorted_by(historical_data_sorted['ticker'], historical_data_sorted['date']):
+        historical_data_sorted.index = pd.RangeIndex(len(historical_data_sorted))
+    else:
+        # a single call, a progress bar around it never shows anything between 0 and 1
+        print("Sorting historical data...")
+        historical_data_sorted = historical_data_sorted.sort_values(['ticker', 'date'], kind='stable', ignore_index=True)
     
-    # Also ensure mapping_df is sorted correctly
-    # It should already be sorted from prepare_mapping_dataframe, but let's be explicit
-    print("Sorting mapping dataframe...")
-    with tqdm(total=1, desc="Sorting mapping dataframe", unit="operation") as pbar:
-        mapping_df_sorted = mapping_df.sort_values(['historical_ticker', 'change_date'], kind='stable').reset_index(drop=True)
-        pbar.update(1)
-
-    # Perform the merge_asof operation
-    # NOTE: merge_asof is a single atomic pandas operation, so we can't show progress during execution
-    # It's optimized C code that runs all at once. We'll just show a message.
-    print(f"Performing merge_asof on {len(historical_data_sorted):,} rows (this may take a while)...")
-    mapped_historical_data  = pd.merge_asof(
-        # Left - the ~23M rows of OHLCV data
-        historical_data_sorted,
-        # Right - ~ 90k rows of ticker changes
-        mapping_df_sorted,
-
-        # Join condition - Find matching dates 
-        left_on = 'date',
-        right_on='change_date',
-
-        # Grouping - only match within the same ticker
-        left_by='ticker',
-        right_by='historical_ticker',
-
-        # Direction - find the most recent change on or before this date
-        direction='backward'
+    # The as-of match needs the mapping sorted by (ticker code, change_date), a categorical sorts by its codes
+    if _is_sorted_by(mapping_df['historical_ticker'], mapping_df['change_date']):
+        mapping_df_sorted = mapping_df.reset_index(drop=True)
+    else:
+        mapping_df_sorted = mapping_df.sort_values(['historical_ticker', 'change_date'], kind='stable', ignore_index=True)
+
+    # Backward as-of join by ticker: for every row the latest change on or before its date for the same
+    # historical ticker. Done as one binary search over (ticker code, day) keys, unlike merge_asof this
+    # does not need the 23M rows sorted by date across all tickers
+    print(f"Resolving current tickers for {len(historical_data_sorted):,} rows...")
+    # codes under ticker_dtype, the same categories the mapping codes and adjusted_ticker use
+    ticker_codes = historical_data_sorted['ticker'].cat.codes.to_numpy()
+    match = _asof_match(
+        ticker_codes,
+        _epoch_days(historical_data_sorted['date']),
+        mapping_df_sorted['historical_ticker'].cat.codes.to_numpy(),
+        _epoch_days(mapping_df_sorted['change_date'])
     )
-    print("Merge_asof completed!")
 
     # Handle tickers with no mapping 
     # I believe this is safe to do for now, because we filled tickers that did not return a mapping with the date 
-    # 2025-11-08, which is earlier than any date in the OHCLV dataframe so the merge_asof should have some nas we can fill
-    # with the original ticker name
-    print("Filling missing mappings and cleaning up...")
-    mapped_historical_data['adjusted_ticker'] = mapped_historical_data['current_ticker'].fillna(mapped_historical_data['ticker'])
+    # 2025-11-08, which is earlier than any date in the OHCLV dataframe so the as-of match should have some misses
+    # we can fill with the original ticker name
+    # One np.where over the int codes, the current ticker's code where there is a match and the row's
+    # own code otherwise. The pad makes match == -1 land on a valid position (also for an empty mapping)
+    current_codes = np.append(mapping_df_sorted['current_ticker'].cat.codes.to_numpy(), -1)
+    adjusted_codes = np.where(match >= 0, current_codes[match], ticker_codes)
+
+    # adjusted_ticker shares ticker's categories, no 23M element object array is built. from_codes is only
+    # right because the unmatched rows fall back to ticker_codes taken after the recode to ticker_dtype
+    mapped_historical_data = historical_data_sorted
+    mapped_historical_data['adjusted_ticker'] = pd.Categorical.from_codes(adjusted_codes, dtype=ticker_dtype)
+
+    return mapped_historical_data
+
+def _is_sorted_by(
+    tickers: pd.Series,
+    dates: pd.Series
+    ) -> bool:
+    """
+    True when the rows are already in sort_values([ticker, date]) order, one vectorized neighbour comparison
+    """
+    if len(tickers) < 2:
+        return True
+
+    # a categorical sorts by its codes, compare those instead of the strings
+    if isinstance(tickers.dtype, pd.CategoricalDtype):
+        tickers = pd.Series(tickers.cat.codes.to_numpy())
+    if not tickers.is_monotonic_increasing:
+        return False
+
+    tickers = tickers.to_numpy()
+    dates = dates.to_numpy()
+    same_ticker = tickers[1:] == tickers[:-1]
+
+    return bool(np.all(~same_ticker | (dates[1:] >= dates[:-1])))
+
+def _epoch_days(dates: pd.Series) -> np.ndarray:
+    """
+    Dates as int64 days since 1970-01-01
+
+    datetime64 columns of any unit (e.g. downcast to datetime64[s]) go straight to days without
+    an upcast copy to ns first, anything else is converted through ns
+    """
+    if dates.dtype.kind == 'M':
+        return dates.to_numpy().astype('datetime64[D]').view('i8')
+    return dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').view('i8')
+
+def _asof_match(
+    codes: np.ndarray,
+    days: np.ndarray,
+    right_codes: np.ndarray,
+    right_days: np.ndarray
+    ) -> np.ndarray:
+    """
+    Backward as-of match by code
+
+    For each (codes[i], days[i]) the position of the last right row with the same code and
+    right_days <= days[i], -1 when there is none. The right side must be sorted by (code, day),
+    equal keys resolve to the last of them like merge_asof.
+    """
+    # pack (code, day) into one int64 that sorts like the pair, days fit in 32 bits either side of the epoch
+    right_keys = (right_codes.astype(np.int64) << 32) + (right_days + 2**31)
+    keys = (codes.astype(np.int64) << 32) + (days + 2**31)
+
+    match = np.searchsorted(right_keys, keys, side='right') - 1
 
-    # Clean up temp columns
-    mapped_historical_data = mapped_historical_data.drop(columns=['historical_ticker', 'change_date', 'current_ticker'])
+    # the candidate only counts when it belongs to the same code
+    found = match >= 0
+    found[found] = right_codes[match[found]] == codes[found]
+    match[~found] = -1
 
-    return mapped_historical_data
\ No newline at end of file
+    return match
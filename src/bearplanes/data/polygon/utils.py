@@ -1,5 +1,18 @@
 """Polygon-specific utility functions."""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, List, Optional
+
+import aiohttp
+import numpy as np
 import pandas as pd
+from dotenv import load_dotenv
+from rich import print
 
 
 def add_datetime(
@@ -27,3 +40,355 @@ def add_datetime(
     cols = ['date'] + [col for col in df.columns if col != 'date']
     return df[cols]
 
+
+
+def get_ticker_list(
+    df: pd.DataFrame,
+    column: str = 'ticker'
+) -> np.ndarray:
+    """
+    Unique tickers in df, without hashing the strings when the column is a category.
+
+    For a category the tickers are read off the categories, a bincount over the int codes drops
+    the ones that no longer have any rows (categories survive filtering). Falls back to unique()
+    for object/string columns. NaN tickers are never included.
+
+    Args:
+        df: DataFrame with a ticker column
+        column: Name of the ticker column
+
+    Returns:
+        numpy array of ticker strings
+    """
+    tickers = df[column]
+
+    if isinstance(tickers.dtype, pd.CategoricalDtype):
+        codes = tickers.cat.codes.to_numpy()
+        counts = np.bincount(codes[codes >= 0], minlength=len(tickers.cat.categories))
+        return tickers.cat.categories.to_numpy()[counts > 0]
+
+    return tickers.dropna().unique()
+
+
+def write_partitioned_parquet(
+    df: pd.DataFrame,
+    root,
+    date_column: str = 'date'
+) -> None:
+    """
+    Write the OHLCV frame to a parquet dataset partitioned by year (root/year=2024/...).
+
+    Read a date range back with read_partitioned_parquet, only the matching year directories are opened.
+
+    Args:
+        df: DataFrame with a datetime64 date column
+        root: Directory for the dataset
+        date_column: Column the year partition is taken from
+    """
+    df.assign(year=df[date_column].dt.year).to_parquet(
+        root,
+        engine='pyarrow',
+        partition_cols=['year'],
+        compression='zstd',
+        index=False
+    )
+
+
+def read_partitioned_parquet(
+    root,
+    start_year: Optional[int] = None,
+    end_year: Optional[int] = None,
+    columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Read the dataset written by write_partitioned_parquet, optionally limited to [start_year, end_year].
+
+    The year filters prune whole partitions so skipped years are never read from disk, and columns
+    limits the read to the columns you need.
+
+    Args:
+        root: Directory of the dataset
+        start_year: First year to read (inclusive), None for no lower bound
+        end_year: Last year to read (inclusive), None for no upper bound
+        columns: Columns to read, None for all
+
+    Returns:
+        DataFrame without the year partition column
+    """
+    filters = []
+    if start_year is not None:
+        filters.append(('year', '>=', start_year))
+    if end_year is not None:
+        filters.append(('year', '<=', end_year))
+
+    df = pd.read_parquet(root, engine='pyarrow', columns=columns, filters=filters or None)
+
+    return df.drop(columns='year', errors='ignore')
+
+
+class FailureLog:
+    """
+    Collects request failures and reports them in batches.
+
+    Printing every failure through rich takes the console lock and re-renders, during a burst of errors
+    (e.g. 429s while the rate limit recovers) that ends up dominating the event loop. add() only appends,
+    one summary line is printed every `every` failures and on flush().
+    """
+
+    def __init__(
+        self,
+        label: str,
+        every: int = 50
+    ):
+        self.label = label
+        self.every = every
+        self.failures = []
+        self._pending = 0
+
+    def add(
+        self,
+        key,
+        error: str
+    ):
+        self.failures.append((key, error))
+        self._pending += 1
+        if self._pending >= self.every:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            print(f"{self._pending} {self.label} failures ({len(self.failures)} total), latest: {self.failures[-5:]}")
+            self._pending = 0
+
+
+class FileCache:
+    """
+    JSON file cache for Polygon REST responses, one file per (endpoint, key) under root.
+
+    Split events and past ticker events do not change, so a cached response is served for ttl_days
+    before it is fetched again. The key is usually the ticker, pass params when more than the ticker
+    shapes the response and they are folded into the file name with an md5.
+    """
+
+    def __init__(
+        self,
+        root=Path('~/.cache/polygon'),
+        ttl_days: float = 90
+    ):
+        self.root = Path(root).expanduser()
+        self.ttl_seconds = ttl_days * 86_400
+
+    def _path(
+        self,
+        endpoint: str,
+        key: str,
+        params: Optional[dict] = None
+    ) -> Path:
+        if params:
+            key = f"{key}_{hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()}"
+        return self.root / endpoint / f"{key}.json"
+
+    def get(
+        self,
+        endpoint: str,
+        key: str,
+        params: Optional[dict] = None
+    ) -> Optional[Any]:
+        """
+        The cached value, None when it is missing, unreadable or older than ttl_days
+        """
+        path = self._path(endpoint, key, params)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['fetched_at'] > self.ttl_seconds:
+            return None
+        return entry['data']
+
+    def set(
+        self,
+        endpoint: str,
+        key: str,
+        value: Any,
+        params: Optional[dict] = None
+    ):
+        path = self._path(endpoint, key, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temp file and rename so an interrupted run never leaves a half written entry
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'fetched_at': time.time(), 'data': value}, f)
+        os.replace(tmp_path, path)
+
+
+class AsyncRateLimiter:
+    """
+    Token bucket for the Polygon REST calls, allows max_rate requests per time_period.
+
+    Acquire it around the request itself (async with limiter: ...) so it throttles dispatch,
+    bursts up to max_rate go out immediately and the bucket refills continuously after that.
+    Separate from the semaphores in the callers, those cap how many requests are in flight.
+
+    Each acquire reserves its token right away (the balance may go negative) and then sleeps only
+    its own wait, so waiters sleep side by side in arrival order instead of queueing behind one
+    sleeper. There is no asyncio primitive inside, one limiter is not tied to an event loop, but
+    create it per run (process_tickers does) so separate runs do not share a bucket.
+    """
+
+    def __init__(
+        self,
+        max_rate: float,
+        time_period: float = 1.0
+    ):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = float(max_rate)
+        self._last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._tokens = min(self.max_rate, self._tokens + elapsed * self.max_rate / self.time_period)
+        self._last_refill = now
+
+    async def acquire(self):
+        # no await between the refill and the reservation, so no other task can interleave
+        self._refill()
+        self._tokens -= 1
+        if self._tokens < 0:
+            # sleep exactly until the reserved token is available
+            await asyncio.sleep(-self._tokens * self.time_period / self.max_rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class AdmissionController:
+    """
+    Concurrency cap for the Polygon requests that adapts to 429 responses, used like a semaphore (async with admission: ...).
+
+    Starts at `initial` requests in flight. A 429 halves the cap so requests stop piling onto a limit that is
+    already pushing back, every `grow_after` successful responses in a row raise it by one again, up to `max_concurrency`.
+    A burst of 429s from requests that were all in flight together only halves the cap once, further 429s
+    within `cooldown` seconds of a cut are ignored.
+
+    get_json_with_retry reports the outcomes (rate_limited on a 429, succeeded on a 2xx), leaving the
+    block does not count as a success, so cache hits and failed requests never grow the cap.
+    """
+
+    def __init__(
+        self,
+        initial: int = 20,
+        max_concurrency: int = 100,
+        grow_after: int = 50,
+        cooldown: float = 1.0
+    ):
+        self.limit = initial
+        self.max_concurrency = max_concurrency
+        self.grow_after = grow_after
+        self.cooldown = cooldown
+        self.active = 0
+        self._successes = 0
+        self._last_cut = float('-inf')
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self):
+        async with self._condition:
+            self.active -= 1
+            # wake as many waiters as there are free slots, more than one after the cap grew
+            self._condition.notify(max(1, self.limit - self.active))
+
+    def rate_limited(self):
+        self._successes = 0
+        # the rest of a burst answers for the same overload, the cap was already cut for it
+        now = time.monotonic()
+        if now - self._last_cut < self.cooldown:
+            return
+        self._last_cut = now
+        self.limit = max(1, self.limit // 2)
+
+    def succeeded(self):
+        self._successes += 1
+        if self._successes >= self.grow_after:
+            self._successes = 0
+            self.limit = min(self.max_concurrency, self.limit + 1)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+        return False
+
+
+@lru_cache(maxsize=1)
+def get_polygon_api_key() -> Optional[str]:
+    """
+    POLYGON_API_KEY from the environment or .env, looked up on first use instead of at import
+    so importing the polygon scripts for their helpers never touches the filesystem
+    """
+    load_dotenv()
+    return os.getenv('POLYGON_API_KEY')
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    One pooled aiohttp session for the Polygon REST requests, connections (and their TLS handshakes)
+    are reused across requests and everything runs on the event loop, no thread per blocking call.
+    The api.polygon.io lookup is cached for 5 minutes instead of aiohttp's default 10 seconds.
+    Authenticates with POLYGON_API_KEY (see get_polygon_api_key). Has to be created inside a running event loop.
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=100, ttl_dns_cache=300),
+        timeout=aiohttp.ClientTimeout(total=30),
+        headers={"Authorization": f"Bearer {get_polygon_api_key()}"}
+    )
+
+
+async def get_json_with_retry(
+    session: aiohttp.ClientSession,
+    limiter: AsyncRateLimiter,
+    url: str,
+    params: dict = None,
+    max_retries: int = 5,
+    admission: Optional[AdmissionController] = None
+):
+    """
+    GET a Polygon REST endpoint on a shared aiohttp session under the rate limiter and return the decoded json.
+
+    429 and 5xx responses and transient connection errors (dropped or refused connections, timeouts) are
+    retried with exponential backoff (0.5s, 1s, 2s, ...). Other http errors and the last failed attempt
+    are raised, as aiohttp.ClientResponseError for a bad status.
+    Each 429 is also reported to the admission controller, if one is passed, so it can lower its cap,
+    and each successful response so it can raise it again.
+    """
+    for attempt in range(max_retries):
+        try:
+            async with limiter:
+                async with session.get(url, params=params) as response:
+                    response.raise_for_status()
+                    data = await response.json()
+            if admission is not None:
+                admission.succeeded()
+            return data
+        except aiohttp.ClientResponseError as e:
+            if e.status == 429 and admission is not None:
+                admission.rate_limited()
+            if not (e.status == 429 or e.status >= 500) or attempt == max_retries - 1:
+                raise
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+            if attempt == max_retries - 1:
+                raise
+        await asyncio.sleep(0.5 * 2 ** attempt)
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from bearplanes.data.polygon.split_events.polygon_split_mapping import \
+    map_splits
+
+
+def make_history():
+    # rows deliberately out of (ticker, date) order
+    rows = [
+        ('AAA', '2024-01-05', 20.0, 100),
+        ('BBB', '2024-01-03', 50.0, 100),
+        ('AAA', '2024-01-02', 8.0, 300),
+        ('AAA', '2024-01-06', 30.0, 100),
+        ('CCC', '2024-01-02', 40.0, 100),
+        ('AAA', '2024-01-04', 24.0, 100),
+        ('AAA', '2024-01-03', 12.0, 600),
+    ]
+    df = pd.DataFrame(rows, columns=['ticker', 'date', 'close', 'volume'])
+    df['date'] = pd.to_datetime(df['date'])
+    df['open'] = df['close'] + 1
+    df['high'] = df['close'] + 2
+    df['low'] = df['close'] - 1
+    return df
+
+
+def make_splits():
+    # AAA splits on its first bar, in the middle and on its last bar, listed newest first
+    return pd.DataFrame({
+        'ticker': ['AAA', 'ZZZ', 'AAA', 'CCC', 'AAA'],
+        'date': ['2024-01-06', '2024-01-03', '2024-01-04', '2023-06-01', '2024-01-02'],
+        'split_from': [3.0, 1.0, 1.0, 1.0, 1.0],
+        'split_to': [1.0, 2.0, 4.0, 5.0, 2.0],
+    })
+
+
+def test_map_splits():
+    history = make_history()
+    original = history.copy()
+
+    result = map_splits(make_splits(), history)
+
+    # a split adjusts the rows strictly before its date by the product of it and every later split:
+    # before 01-04 by 1/4 * 3, from 01-04 up to 01-06 by 3, the last bar and the other tickers by 1
+    price_factor = np.array([3.0, 1.0, 0.75, 1.0, 1.0, 3.0, 0.75])
+    np.testing.assert_allclose(result['adjusted_close'], history['close'] * price_factor)
+    np.testing.assert_allclose(result['adjusted_open'], history['open'] * price_factor)
+    np.testing.assert_allclose(result['adjusted_high'], history['high'] * price_factor)
+    np.testing.assert_allclose(result['adjusted_low'], history['low'] * price_factor)
+    np.testing.assert_allclose(result['adjusted_volume'], history['volume'] / price_factor)
+
+    # row order and the input frame are left as they were
+    pd.testing.assert_frame_equal(result[original.columns], original)
+    pd.testing.assert_frame_equal(history, original)
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+from bearplanes.data.polygon.ticker_change_events.polygon_symbol_mapping import (
+    _asof_match, map_symbols)
+
+
+def test_asof_match():
+    # right side sorted by (code, day), days on both sides of the epoch
+    right_codes = np.array([0, 1, 1, 2])
+    right_days = np.array([40_000, -20, 100, -3_000])
+
+    codes = np.array([1, 1, 1, 1, 0, 2, 2, 3])
+    days = np.array([-5_000, -20, 99, 100, 39_999, -3_000, 50_000, 0])
+
+    match = _asof_match(codes, days, right_codes, right_days)
+
+    # before code 1's first change no match (code 0's change is not picked up), a change counts on its own day,
+    # a row past a code's last change keeps it, a code with no changes never matches
+    np.testing.assert_array_equal(match, [-1, 1, 1, 2, -1, 3, 3, -1])
+
+
+def test_map_symbols():
+    reverse_mapping = {
+        'META': [('META', '2022-06-09'), ('FB', '2012-05-18')],
+        'FB': [('FB', '2025-06-26')],
+    }
+    history = pd.DataFrame({
+        'ticker': ['META', 'FB', 'XYZ', 'FB', 'FB', 'FB'],
+        'date': pd.to_datetime(['2022-06-09', '2020-01-01', '2020-01-01', '2012-05-17', '2012-05-18', '2025-06-26']),
+        'close': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+    })
+    original = history.copy()
+
+    result = map_symbols(reverse_mapping, history, start_date=None)
+
+    # sorted by ticker and date, FB belongs to META from its change date until FB is reused on 2025-06-26
+    assert result['ticker'].astype(str).tolist() == ['FB', 'FB', 'FB', 'FB', 'META', 'XYZ']
+    assert result['close'].tolist() == [4.0, 5.0, 2.0, 6.0, 1.0, 3.0]
+    assert result['adjusted_ticker'].astype(str).tolist() == ['FB', 'META', 'META', 'FB', 'META', 'XYZ']
+    assert result['adjusted_ticker'].dtype == result['ticker'].dtype
+    pd.testing.assert_frame_equal(history, original)
+
+
+def test_map_symbols_categorical_ticker():
+    # categories in first-seen order like a pyarrow dictionary column, not sorted
+    reverse_mapping = {
+        'META': [('META', '2022-06-09'), ('FB', '2012-05-18')],
+        'FB': [('FB', '2025-06-26')],
+    }
+    history = pd.DataFrame({
+        'ticker': pd.Categorical(['XYZ', 'FB', 'META', 'FB'], categories=['XYZ', 'META', 'FB']),
+        'date': pd.to_datetime(['2020-01-01', '2020-01-01', '2022-06-09', '2025-06-26']),
+        'close': [1.0, 2.0, 3.0, 4.0],
+    })
+
+    result = map_symbols(reverse_mapping, history, start_date=None)
+
+    # the tickers are matched by value and the result is sorted by the ticker strings
+    assert result['ticker'].astype(str).tolist() == ['FB', 'FB', 'META', 'XYZ']
+    assert result['close'].tolist() == [2.0, 4.0, 3.0, 1.0]
+    assert result['adjusted_ticker'].astype(str).tolist() == ['META', 'FB', 'META', 'XYZ']
+    # the unmapped XYZ falls back to its own ticker, decoded under the shared sorted categories
+    assert result['adjusted_ticker'].dtype == result['ticker'].dtype
+    assert result['ticker'].cat.categories.is_monotonic_increasing
+    assert history['ticker'].cat.categories.tolist() == ['XYZ', 'META', 'FB']